@@ -0,0 +1,117 @@
+import numpy as np
+
+from ellipsoidFitting import ellipsoidFittingFromStatistics
+from rebuildRtable import rebuildRtableBatch
+from extractData import deltaRBatch, meanBatch
+
+# Backends of the fitness kernel of the genetic algorithms: the deltaR of every table of a stack for one partition
+# (fit of the ellipsoids, rebuild of the tables with their averages, and comparison to the original tables)
+# numpy is the reference, numba compiles the rebuild and the deltaR into a single loop over the tables and cells,
+# it is only used if it can be imported, numba is not needed to run ELLIFANT
+# Both backends fit the ellipsoids with the same solve (see solveNormalEquations): the normal equations of a group can be
+# so badly conditioned that another solve moves the deltaR of a partition by a few percent, and so the best partition
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# The smoothing requests of rebuildRtable, as numbers for the compiled kernel
+REQUESTS = {'none': 0, 'rp': 1, 'cols': 2}
+
+def availableBackends():
+    return ['numpy'] + (['numba'] if numba is not None else [])
+
+def checkBackend(backend):
+    #raises a ValueError if the backend can not be used here
+    if backend not in availableBackends():
+        if backend == 'numba':
+            raise ValueError('The numba backend needs the numba package, install it with "pip install numba" or use the numpy backend')
+        raise ValueError('Unknown backend ' + str(backend) + ', the backends are ' + ', '.join(availableBackends()))
+
+def deltaRNumpy(partition, r_tables, beta, epsilon, statistics, request='rp', originalMeans=None):
+    #the reference: the same functions as the rest of ELLIFANT, one whole stack at a time
+    vs = ellipsoidFittingFromStatistics(*statistics, partition)
+    return deltaRBatch(r_tables, rebuildRtableBatch(vs, partition, beta, epsilon, request=request), originalMeans)
+
+def deltaRNumba(partition, r_tables, beta, epsilon, statistics, request='rp', originalMeans=None):
+    #same as deltaRNumpy, the fit is the numpy one and the compiled kernel does the rest
+    vs = ellipsoidFittingFromStatistics(*statistics, partition)
+    #a single precision stack is not copied, the kernel is also compiled for it
+    r_tables = np.asarray(r_tables)
+    r_tables = np.ascontiguousarray(r_tables, dtype=np.float32 if r_tables.dtype == np.float32 else float)
+    if originalMeans is None:
+        originalMeans = meanBatch(r_tables)
+
+    partition = np.ascontiguousarray(partition).astype(np.int64)
+    betaRad = np.asarray(beta, dtype=float)*np.pi/180
+    epsilon = np.asarray(epsilon, dtype=float)
+
+    return fusedDeltaR(np.ascontiguousarray(vs), r_tables, np.ascontiguousarray(originalMeans, dtype=float), partition, \
+                       np.sin(epsilon), np.cos(epsilon), np.sin(betaRad), np.cos(betaRad), REQUESTS[request])
+
+def deltaRFunction(backend):
+    #the deltaR kernel of a backend
+    checkBackend(backend)
+    return deltaRNumba if backend == 'numba' else deltaRNumpy
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def fusedDeltaR(vs, r_tables, originalMeans, partition, sinEpsilon, cosEpsilon, sinBeta, cosBeta, request):
+        #rebuild (top row and roll averages) and deltaR of every table from its coefficients vs (N, nEll, k),
+        #table by table, without any temporary stack, the cells are computed in the same order of operations as rebuildCells
+        nTables = len(vs)
+        nRows, nCols = partition.shape
+        results = np.zeros(nTables)
+        data = np.zeros((nRows, nCols))
+        newData = np.zeros((nRows, nCols))
+
+        for t in range(nTables):
+            v = vs[t]
+
+            #the rebuilt cells (linear case, there are no q and d values with 5 or 6 coefficients)
+            for i in range(nRows):
+                for j in range(nCols):
+                    g = partition[i, j] - 1
+                    a = v[g, 0] + v[g, 1] - 1
+                    b = v[g, 0] - 2*v[g, 1] - 1
+                    c = v[g, 1] - 2*v[g, 0] - 1
+                    A = a*sinEpsilon[i]**2*cosBeta[j]**2 + b*sinEpsilon[i]**2*sinBeta[j]**2 + c*cosEpsilon[i]**2 + v[g, 2]*sinEpsilon[i]*cosEpsilon[i]*cosBeta[j]
+                    value = 0.0
+                    if A != 0:
+                        value = -(2*v[g, 3]*sinEpsilon[i]*cosBeta[j] + 2*v[g, 4]*cosEpsilon[i]) / A
+                    data[i, j] = value if value > 0 else 0.0
+
+            #the top row is set to its average
+            top = 0.0
+            for j in range(nCols):
+                top += data[0, j]
+            top /= nCols
+            for j in range(nCols):
+                data[0, j] = top
+            newData[:, :] = data
+
+            #the roll averages, see finishRtableBatch
+            if request == 1:
+                for i in range(1, nRows-1):
+                    for j in range(1, nCols-1):
+                        if partition[i, j] != partition[i-1, j]:
+                            newData[i, j] = (data[i, j-1] + data[i, j] + data[i, j+1])/3
+                        if partition[i, j] != partition[i+1, j]:
+                            newData[i, j] = (data[i-1, j] + data[i, j] + data[i+1, j])/3
+            elif request == 2:
+                for j in range(1, nCols-1):
+                    if partition[0, j] != partition[0, j-1] or partition[0, j] != partition[0, j+1]:
+                        for i in range(nRows):
+                            newData[i, j] = (data[i, j-1] + data[i, j] + data[i, j+1])/3
+
+            #deltaR: the RMSE relative to the mean of the two tables
+            squares = 0.0
+            total = 0.0
+            for i in range(nRows):
+                for j in range(nCols):
+                    squares += (r_tables[t, i, j] - newData[i, j])**2
+                    total += newData[i, j]
+            results[t] = 2*np.sqrt(squares/(nRows*nCols)) / (originalMeans[t] + total/(nRows*nCols))
+
+        return results
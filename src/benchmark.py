@@ -0,0 +1,217 @@
+import numpy as np
+import argparse
+import platform
+import datetime
+import json
+import glob
+import time
+import sys
+import os
+
+from ellipsoidFitting import ellipsoidFitting, ellipsoidFittingBatch, cellStatistics
+from rebuildRtable import rebuildRtable, rebuildRtableBatch
+from extractData import deltaR, deltaRBatch, meanBatch
+from partition import stopsToPartition, randomPartitions, randomStopsBatch
+from partitionGenetic import Generation, FitnessPool, mutatePartitions
+from loadData import iterRtables
+from backends import availableBackends, deltaRFunction
+from betaGenetic import allStops
+
+# Micro-benchmarks of the hot paths of the fitting and of the genetic algorithms
+# Every benchmark runs on fixed inputs (the bundled databases and seeded synthetic tables) so two runs can be compared,
+# the timings can be saved as a JSON baseline and a later run compared to it, the script fails if something got slower
+#
+# python benchmark.py -s ../results/baseline.json           (save a baseline)
+# python benchmark.py -c ../results/baseline.json -th 0.2   (fail if a benchmark is more than 20% slower than the baseline)
+#
+# The backends of the fitness kernel (see backends.py) are timed side by side, and before that every backend is checked
+# against the numpy one, the script fails if they do not give the same deltaR
+
+# The standard CIE angles for beta and tan epsilon :
+beta = np.array([0, 2, 5, 10, 15, 20, 25, 30, 35, 40, 45, 60, 75, 90, 105, 120, 135, 150, 165, 180])
+tanEpsilon = np.array([0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8, 8.5, 9, 9.5, 10, 10.5, 11, 11.5, 12])
+epsilon = np.arctan(tanEpsilon)
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the fitting and genetic algorithm hot paths")
+    parser.add_argument('-df', "--dataFolder", required=False, type=str, default="../data", help="The folder containing the databases, default is ../data")
+    parser.add_argument('-d', "--datasets", required=False, type=str, default="Tables_CIE,DryAll,synthetic", help="The databases to run the benchmarks on, \
+                        separated by commas, synthetic is a seeded set of tables built from Tables_CIE, default is Tables_CIE,DryAll,synthetic")
+    parser.add_argument('-cf', "--cacheFolder", required=False, type=str, default="../cache", help="The folder of the parsed workbooks cache, default is ../cache")
+    parser.add_argument('-b', "--benchmarks", required=False, type=str, default="", help="Only run the benchmarks whose name contains one of these words, \
+                        separated by commas, default is all of them")
+    parser.add_argument('-r', "--repeat", required=False, type=int, default=5, help="The minimum number of timed runs of each benchmark, default is 5")
+    parser.add_argument('-t', "--minTime", required=False, type=float, default=1.0, help="The minimum time spent on each benchmark in seconds, default is 1")
+    parser.add_argument('-s', "--save", required=False, type=str, default="none", help="Save the results as a JSON baseline in this file")
+    parser.add_argument('-c', "--compare", required=False, type=str, default="none", help="Compare the results to the JSON baseline in this file")
+    parser.add_argument('-th', "--threshold", required=False, type=float, default=0.2, help="A benchmark regresses if its median time is more than \
+                        this fraction slower than the baseline, default is 0.2 (20%%)")
+    return parser.parse_args(argv)
+
+def loadDataset(name, dataFolder, cacheFolder):
+    #the r-tables of a bundled database, or the synthetic tables, as a (N, 29, 20) stack
+    if name == 'synthetic':
+        return syntheticTables(loadDataset('Tables_CIE', dataFolder, cacheFolder))
+
+    fileList = sorted(glob.glob(os.path.join(dataFolder, name, '*.xlsx')))
+    tables = [r_tb for tableName, filePath, r_tb in iterRtables(fileList, ["None"], [], cacheFolder)]
+    if len(tables) == 0:
+        raise ValueError('No r-tables found in ' + os.path.join(dataFolder, name))
+    return np.array(tables, dtype=float)
+
+def syntheticTables(r_tables, nTables=200, seed=0):
+    #seeded tables close to real ones: random tables of the database with a multiplicative noise on every cell
+    rng = np.random.default_rng(seed)
+    chosen = r_tables[rng.integers(len(r_tables), size=nTables)]
+    return chosen * np.exp(0.1 * rng.standard_normal(chosen.shape))
+
+def timeBenchmark(function, setup=None, repeat=5, minTime=1.0):
+    #times function() at least repeat times and for at least minTime seconds, after one untimed warm up run
+    #setup() is run before every call and is not timed
+    if setup is not None:
+        setup()
+    function()
+
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - start < minTime:
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+
+    times = np.array(times)
+    return {'runs': len(times), 'opsPerSecond': 1 / np.mean(times), 'mean': np.mean(times), 'min': np.min(times),
+            'p50': np.percentile(times, 50), 'p90': np.percentile(times, 90), 'p99': np.percentile(times, 99)}
+
+def benchmarks(datasets, dataFolder, cacheFolder):
+    #yields (name, function, setup) for every benchmark, the inputs are built once here
+    #a random partition with 5 regions and a beta partition, the same for every run
+    partition = randomPartitions(1, 5, np.random.default_rng(0))[0]
+    betaPartition = stopsToPartition([0, 15, 60, 180])
+    population = randomPartitions(30, 5, np.random.default_rng(1))
+
+    yield 'randomPartition/30', lambda: randomPartitions(30, 5, np.random.default_rng(2)), None
+    yield 'mutatePartitions/15', lambda: mutatePartitions(population[:15], 5, 15, np.random.default_rng(3).spawn(15)), None
+
+    for name in datasets:
+        r_tables = loadDataset(name, dataFolder, cacheFolder)
+        vs = ellipsoidFittingBatch(r_tables, partition, beta, epsilon)
+        adjusted = rebuildRtableBatch(vs, partition, beta, epsilon, request='rp')
+
+        #a single table, then the whole database at once
+        yield 'ellipsoidFitting/' + name + '/table', lambda r_tables=r_tables: ellipsoidFitting(r_tables[0], partition, beta, epsilon), None
+        yield 'ellipsoidFitting/' + name, lambda r_tables=r_tables: ellipsoidFittingBatch(r_tables, partition, beta, epsilon), None
+        yield 'rebuildRtable/' + name + '/table', lambda vs=vs: rebuildRtable(vs[0], partition, beta, epsilon, request='rp'), None
+        yield 'rebuildRtable/' + name, lambda vs=vs: rebuildRtableBatch(vs, partition, beta, epsilon, request='rp'), None
+        yield 'rebuildRtable/' + name + '/cols', lambda vs=vs: rebuildRtableBatch(vs, betaPartition, beta, epsilon, request='cols'), None
+        yield 'deltaR/' + name + '/table', lambda r_tables=r_tables, adjusted=adjusted: deltaR(r_tables[0], adjusted[0]), None
+        yield 'deltaR/' + name, lambda r_tables=r_tables, adjusted=adjusted: deltaRBatch(r_tables, adjusted), None
+
+        #the whole fitness kernel of a partition (fit, rebuild and deltaR of every table) with each backend
+        statistics = cellStatistics(r_tables, beta, epsilon)
+        originalMeans = meanBatch(r_tables)
+        for backend in availableBackends():
+            kernel = deltaRFunction(backend)
+            yield 'backend/' + backend + '/' + name, lambda r_tables=r_tables, statistics=statistics, originalMeans=originalMeans, kernel=kernel: \
+                kernel(partition, r_tables, beta, epsilon, statistics, 'rp', originalMeans), None
+
+        #one generation of 30 partitions, evaluated from scratch by a single process
+        pool = FitnessPool(r_tables, beta, epsilon, processes=1)
+
+        def generation(pool=pool):
+            Generation(population, {}, pool, 5, 30, 10, 0, rng=np.random.default_rng(4))
+
+        try:
+            yield 'Generation/' + name, generation, None
+        finally:
+            pool.close()
+
+def checkBackends(r_tables, nPartitions=10, seed=0):
+    #compares the deltaR of every table with every backend to the numpy one, over random partitions and beta partitions
+    #returns the disagreements as (backend, partition number, largest relative difference over the tables)
+    #the beta partitions with a group of a single column are checked on purpose: their normal equations are the worst
+    #conditioned ones, and their deltaR moves by a few percent with the slightest change of the solve (see solveNormalEquations),
+    #every backend fits with the same solve, so only the rounding of the rebuild and of the averages may differ
+    rng = np.random.default_rng(seed)
+    statistics = cellStatistics(r_tables, beta, epsilon)
+    originalMeans = meanBatch(r_tables)
+
+    partitions = [(partition, 'rp') for partition in randomPartitions(nPartitions, 5, rng)]
+    partitions += [(partition, 'cols') for partition in randomStopsBatch(nPartitions, 4, rng)]
+    singleColumns = [stops for stops in allStops(beta, 3) if np.min(np.bincount(stopsToPartition(stops)[0])[1:]) == 1]
+    singleColumns = [[0, 2, 165, 180], [0, 2, 5, 180]] + [singleColumns[i] for i in rng.choice(len(singleColumns), nPartitions, replace=False)]
+    partitions += [(stopsToPartition(stops), 'cols') for stops in singleColumns]
+
+    disagreements = []
+    reference = deltaRFunction('numpy')
+    for n, (partition, request) in enumerate(partitions):
+        expected = reference(partition, r_tables, beta, epsilon, statistics, request, originalMeans)
+        for backend in availableBackends():
+            if backend == 'numpy':
+                continue
+            difference = np.max(np.abs(deltaRFunction(backend)(partition, r_tables, beta, epsilon, statistics, request, originalMeans) - expected) / expected)
+            if difference > 1e-12:
+                disagreements.append((backend, n, difference))
+    return disagreements
+
+def compareResults(results, baseline, threshold):
+    #returns the names of the benchmarks whose median time is more than threshold slower than in the baseline
+    regressions = []
+    print("\nComparison to the baseline (median times):")
+    for name, result in results.items():
+        if name not in baseline['results']:
+            print("%-40s not in the baseline" % name)
+            continue
+        ratio = result['p50'] / baseline['results'][name]['p50']
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print("%-40s %8.3fx %s" % (name, ratio, 'REGRESSION' if regressed else ''))
+    return regressions
+
+def main():
+    args = parseArguments(sys.argv[1:])
+    datasets = args.datasets.split(',')
+    filters = [word for word in args.benchmarks.split(',') if word != '']
+    cacheFolder = None if args.cacheFolder == 'none' else args.cacheFolder
+
+    #the backends are checked before they are timed
+    if len(availableBackends()) > 1 and (len(filters) == 0 or any(word in 'backend/' + '/'.join(availableBackends()) for word in filters)):
+        for name in datasets:
+            disagreements = checkBackends(loadDataset(name, args.dataFolder, cacheFolder))
+            for backend, n, difference in disagreements:
+                print("The %s backend disagrees with numpy on %s, partition %s: relative difference of %.2e" % (backend, name, n, difference))
+            if len(disagreements) > 0:
+                return 1
+        print("The backends " + ', '.join(availableBackends()) + " agree\n")
+
+    results = {}
+    print("%-40s %12s %10s %10s %10s %10s %6s" % ('benchmark', 'ops/sec', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'min (ms)', 'runs'))
+    for name, function, setup in benchmarks(datasets, args.dataFolder, cacheFolder):
+        if len(filters) > 0 and not any(word in name for word in filters):
+            continue
+        result = timeBenchmark(function, setup, args.repeat, args.minTime)
+        results[name] = result
+        print("%-40s %12.2f %10.3f %10.3f %10.3f %10.3f %6d" % (name, result['opsPerSecond'], 1e3*result['p50'], 1e3*result['p90'], \
+                                                                1e3*result['p99'], 1e3*result['min'], result['runs']))
+
+    if args.save != 'none':
+        with open(args.save, 'w') as f:
+            json.dump({'date': datetime.datetime.now().isoformat(), 'python': platform.python_version(), 'numpy': np.__version__, \
+                       'machine': platform.platform(), 'results': results}, f, indent=2)
+        print("\nSaved the baseline to " + args.save)
+
+    if args.compare != 'none':
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compareResults(results, baseline, args.threshold)
+        if len(regressions) > 0:
+            print("\n%s benchmark(s) regressed by more than %s%%: %s" % (len(regressions), round(100*args.threshold), ', '.join(regressions)))
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
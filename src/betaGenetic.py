@@ -1,47 +1,150 @@
 import numpy as np
+import itertools
 
-from partition import randomStops
-from partitionGenetic import Generation
-
-def fitBetaGenetic(r_tables, beta, epsilon, nMaxGen, nIndiv, nEll, verbose):
-
-    # Initialize population of nIndiv betaPartitions, each with nEll ellipsoids
-    partitions = np.array([randomStops(nEll) for i in range(nIndiv)])
-    # This is to make sure that each partition has nEll ellipsoids
-
-    for i in range(nIndiv):
-        while nEll != len(np.unique(partitions[i])):
-            partitions[i] = randomStops(nEll)
-            
-    # Initialize fitnessLogs map to store fitness values (key: partition, value: fitness)
-    fitnessLogs = {}
-
-    counter, reign = 0, 0
-    while reign < nMaxGen and counter < 10000:
-        counter += 1
-        print("Generation " + str(counter))
-
-        # Compute fitness of each partition
-        OldChampion = partitions[0]
-        partitions, fitnessLogs = Generation(partitions, fitnessLogs, r_tables, beta, epsilon, nEll, nIndiv, nMaxGen, reign)
-        adjustPartitions(partitions, nEll)
-        Champion = partitions[0]
-
-        # Check if the best partition has changed, if not, increment the counter
-        if np.array_equal(OldChampion, Champion):
-            reign += 1
-        else :
-            reign = 1
-        if verbose:
-            print("Best partition of generation " + str(counter) + " has a deltaR over this data of " + \
-                str(round(fitnessLogs[str(partitions[0])], 3)) + ", it has won the last " + str(reign) + " generations.")
+from partition import randomStopsBatch, stopsToPartition
+from partitionGenetic import Generation, FitnessPool, partitionKey, fitIslands, tableBatches
+from extractData import meanBatch
+from profiler import Profiler
+from fitnessCache import tablesHash
+from checkpoint import saveCheckpoint, loadCheckpoint, removeCheckpoint
+from stopping import StoppingRules
+
+def fitBetaGenetic(r_tables, beta, epsilon, nMaxGen, nIndiv, nEll, verbose, fitnessCache=None, rng=None, profiler=None, \
+                   checkpoint=None, checkpointEvery=10, resume=None, islands=0, migrationInterval=5, nMigrants=2, \
+                   stopping=None, screening=0, screeningTables=0.1, batchSize=0, weights=None, backend='numpy'):
+
+    if rng is None:
+        rng = np.random.default_rng()
+    if profiler is None:
+        profiler = Profiler()
+    if stopping is None:
+        stopping = StoppingRules()
+
+    # Mini-batch mode: every generation scores its population over one batch of batchSize tables (see batchOrder)
+    batches = None
+    if 0 < batchSize < len(r_tables):
+        if screening > 0:
+            raise ValueError('The screening can not be combined with the mini-batches')
+        batches = tableBatches(meanBatch(r_tables), batchSize)
+
+    # Island model: islands populations of nIndiv beta partitions evolve side by side (see partitionGenetic.fitIslands)
+    if islands > 1:
+        rngs = rng.spawn(islands)
+        populations = [randomStopsBatch(nIndiv, nEll, islandRng) for islandRng in rngs]
+        with profiler.stage('islands'):
+            return fitIslands(r_tables, beta, epsilon, populations, nEll, nIndiv, nMaxGen, rngs, verbose, fitnessCache, adjust=adjustPartitions, \
+                              migrationInterval=migrationInterval, nMigrants=nMigrants, stopping=stopping, screening=screening, screeningTables=screeningTables, \
+                              batches=batches, weights=weights, backend=backend, algorithm='bga', checkpoint=checkpoint, checkpointEvery=checkpointEvery, \
+                              resume=resume)
+
+    # A resumed run goes on from its checkpoint, with the same population, counters, fitness logs and random stream
+    if resume is not None:
+        state = loadCheckpoint(resume, 'bga', r_tables, nEll, weights)
+        partitions, fitnessLogs, counter, reign, rng = state['partitions'], state['fitnessLogs'], state['counter'], state['reign'], state['rng']
+        evaluations = state['evaluations']
+        print("Resuming from " + resume + " at generation " + str(counter))
+    else:
+        # Initialize population of nIndiv betaPartitions, each with exactly nEll ellipsoids
+        partitions = randomStopsBatch(nIndiv, nEll, rng)
+
+        # Initialize fitnessLogs map to store fitness values (key: partition, value: fitness)
+        fitnessLogs = {}
+        counter, reign = 0, 0
+        evaluations = 0
+
+    # The r-tables are only hashed once for all the checkpoints
+    hashOfTables = tablesHash(r_tables, weights) if checkpoint is not None else None
+
+    # The worker processes live for the whole run and receive the r-tables only once
+    with profiler.stage('fitness pool setup'):
+        pool = FitnessPool(r_tables, beta, epsilon, cachePath=fitnessCache, screeningTables=screeningTables if screening > 0 else 0, weights=weights, \
+                           backend=backend)
+
+    with pool:
+
+        stopping.begin()
+        while reign < nMaxGen and counter < 10000:
+            # The budgets are checked between two generations, a stopped run ends with its best partition so far
+            # and leaves a checkpoint behind, so that it can be resumed later
+            reason = stopping.stopReason(evaluations + pool.evaluations)
+            if reason is not None:
+                print("Stopping after generation " + str(counter) + ": " + reason)
+                if checkpoint is not None and checkpointEvery > 0:
+                    with profiler.stage('checkpoint'):
+                        saveCheckpoint(checkpoint, 'bga', r_tables, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables, \
+                                       evaluations=evaluations + pool.evaluations)
+                break
+
+            counter += 1
+            print("Generation " + str(counter))
+
+            # Compute fitness of each partition
+            OldChampion = partitions[0]
+            with profiler.stage('generation'):
+                partitions, fitnessLogs = Generation(partitions, fitnessLogs, pool, nEll, nIndiv, nMaxGen, reign, adjust=adjustPartitions, rng=rng, screening=screening, \
+                                                     batch=None if batches is None else batches[(counter-1) % len(batches)])
+            Champion = partitions[0]
+            stopping.update(fitnessLogs[partitionKey(Champion)])
+
+            # Check if the best partition has changed, if not, increment the counter
+            if np.array_equal(OldChampion, Champion):
+                reign += 1
+            else :
+                reign = 1
+            if verbose:
+                print("Best partition of generation " + str(counter) + " has a deltaR over this data of " + \
+                    str(round(fitnessLogs[partitionKey(partitions[0])], 3)) + ", it has won the last " + str(reign) + " generations.")
+
+            # Save everything the run needs to go on from here every checkpointEvery generations
+            if checkpoint is not None and checkpointEvery > 0 and counter % checkpointEvery == 0:
+                with profiler.stage('checkpoint'):
+                    saveCheckpoint(checkpoint, 'bga', r_tables, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables, \
+                                   evaluations=evaluations + pool.evaluations)
+        else:
+            # The run came to its end (it was not stopped by a budget), there is nothing left to resume
+            if checkpoint is not None:
+                removeCheckpoint(checkpoint)
 
     # Return the best partition (smaller fitness value is better)
-    return partitions[0], fitnessLogs[str(partitions[0])]
+    return partitions[0], fitnessLogs[partitionKey(partitions[0])]
 
 def adjustPartitions(partitions, nEll):
     #every partition gets its first column set to ones and its last column set to nEll
     for p in partitions:
         for i in range(len(p)):
             p[i][0] = 1
-            p[i][-1] = nEll
\ No newline at end of file
+            p[i][-1] = nEll
+
+def allStops(beta, nEll):
+    #every stops vector that gives a partition with exactly nEll ellipsoids:
+    #the inner stops are nEll-1 distinct values of beta, taken between beta[1] and beta[-2] so that no group is empty
+    for columns in itertools.combinations(range(1, len(beta)-1), nEll-1):
+        yield np.concatenate(([0], beta[list(columns)], [180]))
+
+def fitBetaExhaustive(r_tables, beta, epsilon, nEll, verbose, fitnessCache=None, chunkSize=1000, profiler=None, weights=None, backend='numpy'):
+    #evaluates every valid stops vector instead of searching for the best one with a genetic algorithm,
+    #there are only C(18, nEll-1) of them (153 for 3 ellipsoids, 8568 for 6), so the optimum found is proven
+    stops = list(allStops(beta, nEll))
+    if verbose:
+        print("Evaluating the " + str(len(stops)) + " stops vectors for " + str(nEll) + " ellipsoids...")
+
+    if profiler is None:
+        profiler = Profiler()
+
+    fitnesses = []
+    with profiler.stage('fitness pool setup'):
+        pool = FitnessPool(r_tables, beta, epsilon, cachePath=fitnessCache, weights=weights, backend=backend)
+
+    with pool:
+        for start in range(0, len(stops), chunkSize):
+            keys = [partitionKey(stopsToPartition(s)) for s in stops[start:start+chunkSize]]
+            with profiler.stage('evaluation'):
+                fitnesses += pool.evaluate(keys)
+            if verbose:
+                print("Evaluated " + str(len(fitnesses)) + " of " + str(len(stops)) + " stops vectors, best deltaR so far: " + str(round(min(fitnesses), 3)))
+
+    #rank all the stops vectors (smaller fitness value is better)
+    order = np.argsort(fitnesses, kind='stable')
+    ranking = [(stops[i], fitnesses[i]) for i in order]
+
+    return stopsToPartition(ranking[0][0]), ranking[0][1], ranking
@@ -0,0 +1,54 @@
+import numpy as np
+import pickle
+import os
+
+from fitnessCache import tablesHash
+
+# Checkpoints of the genetic algorithms: everything a run needs to go on exactly where it stopped
+# (the population, the counters, the fitness logs and the random generator, which keeps its spawned streams count)
+# A checkpoint is written to a temporary file first and then moved over the previous one, so a run killed while
+# writing always leaves the last complete checkpoint behind
+# A run that comes to its end removes its checkpoint, only the runs stopped by a budget (or killed) leave one to resume from
+
+def saveCheckpoint(path, algorithm, r_tables, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables=None, weights=None, evaluations=None):
+    #evaluations is the count of fitness evaluations the evaluation budget is checked against (see FitnessPool.evaluations)
+    if hashOfTables is None:
+        hashOfTables = tablesHash(r_tables, weights)
+    if evaluations is None:
+        evaluations = len(fitnessLogs)
+    state = {'algorithm': algorithm, 'tables': hashOfTables, 'nEll': nEll, 'partitions': partitions, 'fitnessLogs': fitnessLogs,
+             'counter': counter, 'reign': reign, 'rng': rng, 'evaluations': evaluations}
+
+    temporaryPath = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporaryPath, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporaryPath, path)
+
+def loadCheckpoint(path, algorithm, r_tables, nEll, weights=None):
+    #the checkpoint has to come from the same algorithm, over the same r-tables, with the same number of ellipsoids
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+
+    if state['algorithm'] != algorithm:
+        raise ValueError('The checkpoint %s comes from the %s algorithm, not from the %s algorithm' % (path, state['algorithm'], algorithm))
+    if state['nEll'] != nEll:
+        raise ValueError('The checkpoint %s is for %s ellipsoids, not %s' % (path, state['nEll'], nEll))
+    if state['tables'] != tablesHash(r_tables, weights):
+        raise ValueError('The checkpoint %s was made over other r-tables' % path)
+
+    #older checkpoints hold their partitions as floats, the populations are one byte grids now
+    state['partitions'] = np.asarray(state['partitions']).astype(np.uint8)
+    #and they did not count their evaluations, every partition of their fitness logs was evaluated once
+    state.setdefault('evaluations', len(state['fitnessLogs']))
+    return state
+
+def islandCheckpoint(path, index):
+    #every island of an island run has its own checkpoint next to the path of the run
+    #results_DryAll_5_pga_checkpoint.pkl gives results_DryAll_5_pga_checkpoint_island0.pkl for the first island
+    root, extension = os.path.splitext(path)
+    return root + '_island' + str(index) + extension
+
+def removeCheckpoint(path):
+    #the checkpoint of a run that came to its end, if it was ever saved
+    if os.path.exists(path):
+        os.remove(path)
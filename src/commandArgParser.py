@@ -1,6 +1,8 @@
 import argparse
 import sys, os
 
+from checkpoint import islandCheckpoint
+
 class CommandLineArgs:
 
     def __init__(self, args):
@@ -20,6 +22,7 @@ class CommandLineArgs:
         #what to do with the data (these are mutually exclusive)
         self.ellipsoidAdjusting = None
         self.betaGeneticAlgorithm = None
+        self.betaExhaustiveSearch = None
         self.partitioningGeneticAlgorithm = None
 
         #Booleans for the different options
@@ -34,6 +37,29 @@ class CommandLineArgs:
         #other
         self.genetics = None
         self.stops = None
+        self.fitnessCache = None
+        self.cacheFolder = None
+        self.noCache = None
+        self.noDeduplication = None
+        self.jobs = None
+        self.chunkSize = None
+        self.profile = None
+        self.resume = None
+        self.checkpointEvery = None
+        self.islands = None
+        self.migrationInterval = None
+        self.migrants = None
+        self.timeBudget = None
+        self.evalBudget = None
+        self.convergenceWindow = None
+        self.convergenceTolerance = None
+        self.screening = None
+        self.screeningTables = None
+        self.batchSize = None
+        self.representatives = None
+        self.backend = None
+        self.float32 = None
+        self.cProfile = None
         self.verbose = None
 
     def parse_args(self):
@@ -51,6 +77,8 @@ class CommandLineArgs:
 
         parser.add_argument('-ea',"--ellipsoidAdjusting", required=False, action='store_true', default=None, help="If this argument is given, the ellipsoid adjusting algorithm will be run on the data once")
         parser.add_argument('-bga',"--betaGeneticAlgorithm", required=False, action='store_true', default=None, help="If this argument is given, the beta genetic algorithm will be run on the data once")
+        parser.add_argument('-bes',"--betaExhaustiveSearch", required=False, action='store_true', default=None, help="If this argument is given, every stops vector for the number of ellipsoids given in -g will be evaluated, \
+                            giving the best beta partition for sure, an exact alternative to -bga")
         parser.add_argument('-pga',"--partitioningGeneticAlgorithm", required=False, action='store_true', default=None, help="If this argument is given, the partitioning genetic algorithm will be run on the data once")
 
         parser.add_argument('-sh',"--showImages", required=False, action='store_true', help="If this argument is given, the images will be shown, may trigger a warning if there are too many")
@@ -66,6 +94,77 @@ class CommandLineArgs:
         parser.add_argument('-ct',"--coloredOriginalTables", required=False, action='store_true', help="If this argument is given, the original tables will be colored according to the ellipsoids they are in")
         parser.add_argument('-cz',"--conserveZeros", required=False, action='store_true', help="If this argument is given, the program will keep the zeros in the original tables")
 
+        parser.add_argument('-cache',"--fitnessCache", required=False, type=str, default='none', help="The sqlite file where the genetic algorithms store and look up their fitness values, \
+                            so that runs over the same data reuse each other's evaluations, default is none (no cache). Example : ../results/fitnessCache.sqlite")
+
+        parser.add_argument('-cf',"--cacheFolder", required=False, type=str, default="../cache", help="The folder where the parsed excel files are cached, default is the adjacent folder 'cache', \
+                            it is created if needed and a file is parsed again as soon as it changes")
+        parser.add_argument('-nc',"--noCache", required=False, action='store_true', help="If this argument is given, the excel files are parsed again and the cache folder is not used")
+
+        parser.add_argument('-nd',"--noDeduplication", required=False, action='store_true', help="If this argument is given, the r-tables found several \
+                            times (same values) are fitted and scored once per copy instead of once")
+
+        parser.add_argument('-j',"--jobs", required=False, type=int, default=1, help="The number of processes used to load the excel files (one file per process) \
+                            and to run the ellipsoid adjusting algorithm (the r-tables are spread over the processes), default is 1")
+
+        parser.add_argument('-cs',"--chunkSize", required=False, type=int, default=0, help="The number of r-tables the ellipsoid adjusting algorithm keeps in memory at a time, \
+                            the tables are read, processed and written chunk by chunk, default is 0 (all the tables at once, the memory is not bounded)")
+
+        parser.add_argument('-rs',"--resume", required=False, type=str, default='none', help="The checkpoint file of an interrupted genetic algorithm run (-bga or -pga) \
+                            to go on from, the run continues exactly where it stopped, default is none (start a new run)")
+
+        parser.add_argument('-ce',"--checkpointEvery", required=False, type=int, default=10, help="The genetic algorithms save a checkpoint in the save folder \
+                            every this many generations, default is 10, 0 to never save one")
+
+        parser.add_argument('-is',"--islands", required=False, type=int, default=0, help="The number of populations (islands) the genetic algorithms evolve \
+                            side by side, one process each, default is 0 (a single population)")
+
+        parser.add_argument('-mi',"--migrationInterval", required=False, type=int, default=5, help="The number of generations between two migrations \
+                            of the best partitions from an island to the next one, default is 5, 0 for no migration")
+
+        parser.add_argument('-nm',"--migrants", required=False, type=int, default=2, help="The number of best partitions an island sends to the next one \
+                            at each migration, default is 2")
+
+        parser.add_argument('-tb',"--timeBudget", required=False, type=float, default=0, help="The wall time in seconds after which the genetic algorithms \
+                            stop and keep their best partition so far, default is 0 (no time budget)")
+
+        parser.add_argument('-eb',"--evalBudget", required=False, type=int, default=0, help="The number of partitions the genetic algorithms evaluate \
+                            before they stop and keep their best partition so far, default is 0 (no evaluation budget)")
+
+        parser.add_argument('-cw',"--convergenceWindow", required=False, type=int, default=0, help="The genetic algorithms stop when the best deltaR \
+                            has improved by less than --convergenceTolerance over this many generations, default is 0 (no convergence test)")
+
+        parser.add_argument('-ctol',"--convergenceTolerance", required=False, type=float, default=1e-4, help="The smallest improvement of the best deltaR \
+                            over --convergenceWindow generations for the genetic algorithms to go on, default is 1e-4")
+
+        parser.add_argument('-sc',"--screening", required=False, type=float, default=0, help="If this argument is given, the new partitions of the genetic \
+                            algorithms are first scored over a few tables, and only this fraction of them (the best ones) get their exact deltaR, default is 0 (no screening)")
+
+        parser.add_argument('-st',"--screeningTables", required=False, type=float, default=0.1, help="The fraction of the tables the screening of --screening \
+                            scores the new partitions over, default is 0.1")
+
+        parser.add_argument('-bs',"--batchSize", required=False, type=int, default=0, help="If this argument is given, every generation of the genetic \
+                            algorithms scores its partitions over a batch of this many tables, another batch each generation, and only the best one over all the tables, \
+                            default is 0 (all the tables every generation)")
+
+        parser.add_argument('-rep',"--representatives", required=False, type=int, default=0, help="If this argument is given, the tables are clustered \
+                            by their shape and the genetic algorithms search over this many representative tables (weighted by the size of their cluster), \
+                            the best partition is then scored over all the tables, default is 0 (all the tables)")
+
+        parser.add_argument('-be',"--backend", required=False, type=str, default="numpy", choices=["numpy", "numba"], help="The backend of the fitness \
+                            of the genetic algorithms, numba fits with the same numpy solve and compiles the rebuild, roll averages and deltaR of a partition \
+                            into a single kernel, it needs the numba package, default is numpy")
+
+        parser.add_argument('-f32',"--float32", required=False, action='store_true', help="If this argument is given, the r-tables are kept in a single \
+                            precision stack, only this stack takes half the memory, the fitting is still done in double precision, the genetic algorithms \
+                            also keep the double precision fitting statistics of every cell (tens of times the size of the stack) and barely save anything")
+
+        parser.add_argument('-prof',"--profile", required=False, action='store_true', help="If this argument is given, the wall time, CPU time and peak memory \
+                            of every stage of the run (loading, fitting, plotting, writing, every generation...) are printed and saved in the save folder")
+
+        parser.add_argument('-cprof',"--cProfile", required=False, action='store_true', help="If this argument is given, the run is also profiled with cProfile \
+                            and the statistics are saved in a .prof file in the save folder (implies --profile)")
+
         parser.add_argument('-v',"--verbose", required=False, action='store_true', help="If this argument is given, the program will print more information")
 
         self.args = parser.parse_args()
@@ -80,6 +179,7 @@ class CommandLineArgs:
 
         self.ellipsoidAdjusting = self.args.ellipsoidAdjusting
         self.betaGeneticAlgorithm = self.args.betaGeneticAlgorithm
+        self.betaExhaustiveSearch = self.args.betaExhaustiveSearch
         self.partitioningGeneticAlgorithm = self.args.partitioningGeneticAlgorithm
 
         self.showImages = self.args.showImages
@@ -94,6 +194,29 @@ class CommandLineArgs:
         self.partition = self.args.partition
         self.coloredOriginalTables = self.args.coloredOriginalTables
         self.conserveZeros = self.args.conserveZeros
+        self.fitnessCache = self.args.fitnessCache
+        self.cacheFolder = self.args.cacheFolder
+        self.noCache = self.args.noCache
+        self.noDeduplication = self.args.noDeduplication
+        self.jobs = self.args.jobs
+        self.chunkSize = self.args.chunkSize
+        self.profile = self.args.profile
+        self.resume = self.args.resume
+        self.checkpointEvery = self.args.checkpointEvery
+        self.islands = self.args.islands
+        self.migrationInterval = self.args.migrationInterval
+        self.migrants = self.args.migrants
+        self.timeBudget = self.args.timeBudget
+        self.evalBudget = self.args.evalBudget
+        self.convergenceWindow = self.args.convergenceWindow
+        self.convergenceTolerance = self.args.convergenceTolerance
+        self.screening = self.args.screening
+        self.screeningTables = self.args.screeningTables
+        self.batchSize = self.args.batchSize
+        self.representatives = self.args.representatives
+        self.backend = self.args.backend
+        self.float32 = self.args.float32
+        self.cProfile = self.args.cProfile
 
         self.verbose = self.args.verbose
 
@@ -101,7 +224,7 @@ class CommandLineArgs:
     
 def checkCommandLineArguments(folderPath, saveFolder, saveImageFolder, saveDataName, \
                             plotTypes, ellipsoidAdjusting, betaGeneticAlgorithm, partitioningGeneticAlgorithm, \
-                            genetics, partition, verbose):
+                            genetics, partition, verbose, fitnessCache='none', betaExhaustiveSearch=None, resume='none'):
     
     #check if the folder path is valid
     if not os.path.isdir(folderPath):
@@ -118,6 +241,16 @@ def checkCommandLineArguments(folderPath, saveFolder, saveImageFolder, saveDataN
         print("The save image folder given does not exist.")
         sys.exit(1)
 
+    #check if the folder of the fitness cache is valid
+    if fitnessCache != 'none' and not os.path.isdir(os.path.dirname(os.path.abspath(fitnessCache))):
+        print("The folder of the fitness cache given does not exist.")
+        sys.exit(1)
+
+    #check if the checkpoint to resume from exists (or the checkpoints of its islands, for an island run)
+    if resume != 'none' and not os.path.isfile(resume) and not os.path.isfile(islandCheckpoint(resume, 0)):
+        print("The checkpoint file given does not exist.")
+        sys.exit(1)
+
     if verbose:
         print("\nCommand line arguments parsed successfully.")
 
@@ -134,9 +267,14 @@ def checkCommandLineArguments(folderPath, saveFolder, saveImageFolder, saveDataN
         print("The plot types given are not valid.")
         sys.exit(1)
 
-    #check if the user gave one of the three algorithms only
-    if sum([ellipsoidAdjusting is not None, betaGeneticAlgorithm is not None, partitioningGeneticAlgorithm is not None]) != 1:
-        print("You must give exactly one of the three algorithms, -ea, -bga or -pga.")
+    #check if the user gave one of the four algorithms only
+    if sum([ellipsoidAdjusting is not None, betaGeneticAlgorithm is not None, partitioningGeneticAlgorithm is not None, betaExhaustiveSearch is not None]) != 1:
+        print("You must give exactly one of the four algorithms, -ea, -bga, -bes or -pga.")
+        sys.exit(1)
+
+    #the exhaustive search needs at least two ellipsoids and at most one per inner column of beta
+    if betaExhaustiveSearch is not None and not 2 <= genetics[0] <= 19:
+        print("Error: the beta exhaustive search needs between 2 and 19 ellipsoids, found %d" % genetics[0])
         sys.exit(1)
 
     #check if the partition is a stops vetor or a partition filepath
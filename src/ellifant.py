@@ -5,20 +5,20 @@ import time
 import glob
 import sys
 import os
+from openpyxl import Workbook
 
-from ellipsoidFitting import ellipsoidFitting
-from rebuildRtable import rebuildRtable
+from ellipsoidAdjusting import adjustRtablesParallel, adjustingPool
 from commandArgParser import CommandLineArgs, checkCommandLineArguments
 from partition import loadPartition, stopsToPartition, partitionToStops
-from plotRtables import plotRtable, plotRtableCompare
-from partitionGenetic import fitPartitionGenetic
-from betaGenetic import fitBetaGenetic
-
-from extractData import S1
-from extractData import Q0
-from extractData import Qd
-from extractData import Q0_Trapezes
-from extractData import RMSE, deltaR, Smoothness, deltaQ0S1, Entropy
+from plotRtables import plotRtable
+from partitionGenetic import fitPartitionGenetic, fitness
+from betaGenetic import fitBetaGenetic, fitBetaExhaustive
+from loadData import iterRtables, iterRtableChunks, uniqueRtables, stackRtables
+from representatives import representativeTables as clusterRtables
+from profiler import Profiler
+from stopping import StoppingRules
+from backends import checkBackend
+from extractData import loadQ0Weights
 
 def main():
     # The standard CIE angles for beta and tan epsilon :
@@ -46,6 +46,7 @@ def main():
 
     ellipsoidAdjusting = cmd_args.ellipsoidAdjusting
     betaGeneticAlgorithm = cmd_args.betaGeneticAlgorithm
+    betaExhaustiveSearch = cmd_args.betaExhaustiveSearch
     partitioningGeneticAlgorithm = cmd_args.partitioningGeneticAlgorithm
 
     showImages = cmd_args.showImages
@@ -61,6 +62,29 @@ def main():
 
     genetics = cmd_args.genetics
     partition = cmd_args.partition
+    fitnessCache = cmd_args.fitnessCache
+    cacheFolder = cmd_args.cacheFolder
+    noCache = cmd_args.noCache
+    noDeduplication = cmd_args.noDeduplication
+    jobs = cmd_args.jobs
+    profile = cmd_args.profile
+    resume = cmd_args.resume
+    checkpointEvery = cmd_args.checkpointEvery
+    islands = cmd_args.islands
+    migrationInterval = cmd_args.migrationInterval
+    migrants = cmd_args.migrants
+    timeBudget = cmd_args.timeBudget
+    evalBudget = cmd_args.evalBudget
+    convergenceWindow = cmd_args.convergenceWindow
+    convergenceTolerance = cmd_args.convergenceTolerance
+    screening = cmd_args.screening
+    screeningTables = cmd_args.screeningTables
+    batchSize = cmd_args.batchSize
+    representatives = cmd_args.representatives
+    backend = cmd_args.backend
+    float32 = cmd_args.float32
+    dumpCProfile = cmd_args.cProfile
+    chunkSize = cmd_args.chunkSize
 
     verbose = cmd_args.verbose
 
@@ -85,7 +109,32 @@ def main():
 
     checkCommandLineArguments(folderPath, saveFolder, saveImageFolder, saveDataName, \
                                 plotTypes, ellipsoidAdjusting, betaGeneticAlgorithm, \
-                                partitioningGeneticAlgorithm, genetics, partition, verbose)
+                                partitioningGeneticAlgorithm, genetics, partition, verbose, fitnessCache, betaExhaustiveSearch, resume)
+
+    #the numba backend can only be used if numba is installed
+    try:
+        checkBackend(backend)
+    except ValueError as error:
+        print("Error: " + str(error))
+        sys.exit(1)
+
+    #the parsed excel files are cached unless the user does not want it
+    if noCache:
+        cacheFolder = None
+
+    #the genetic algorithms only use a fitness cache if one is given
+    if fitnessCache == 'none':
+        fitnessCache = None
+
+    #a genetic algorithm run starts from scratch unless the user gives a checkpoint to resume from
+    if resume == 'none':
+        resume = None
+
+    #the stages of the run are timed if the user asked for it
+    profiler = Profiler(profile, dumpCProfile)
+
+    #the budgets of the genetic algorithms, their wall time is counted from here
+    stopping = StoppingRules(timeBudget, evalBudget, convergenceWindow, convergenceTolerance)
     
     # ----------------------------------
     # ---------- LOAD THE DATA ---------
@@ -106,172 +155,190 @@ def main():
         print("Found " + str(len(fileList)) + " file(s).\n")
         print("Loading the data from the files...")
 
-    #load the data from the files
-
-    r_tables = []
-    r_tables_names = []
-
-    for filePath in fileList:
-        with pd.ExcelFile(filePath) as file:
-            for i, sheet in enumerate(file.sheet_names):
-                
-                #Feuil1 is the default name of the first sheet in an excel file, we don't want to use it for most databases
-                if file.sheet_names[i] == 'Feuil1'or file.sheet_names[i] in ignore:
-                    if verbose:
-                        print('Sheet %s in file %s is ignored, skipping' % (file.sheet_names[i], filePath))
-                    continue
-
-                #if the user specified the sheets to use, we only want to use those
-                if sheets != ["None"] and file.sheet_names[i] not in sheets:
-                    if verbose:
-                        print('Sheet %s in file %s is not in the list of sheets to use, skipping' % (file.sheet_names[i], filePath))
-                        print('looking for sheets: ' + str(sheets))
-                    continue
-                    
-                # read the data from the excel file and store it in a dataframe
-                r_tb = pd.read_excel(filePath, sheet_name=sheet, header=None)
-
-                # resize the r_tb to be 20*29
-                r_tb = r_tb.iloc[0:29, 0:20]
-
-                # if the dataframe is smaller than 20*29, return an error and exit
-                if r_tb.shape[0] < 29 or r_tb.shape[1] < 20:
-                    continue
-                
-                # if there are any Nan values, retrun an error and exit
-                if r_tb.isnull().values.any():
-                    print('Error: File %s contains NaN values in sheet %s, this is not an r-table, call it \
-                            \'Feuil1\' for it to be skipped or correct the error' % (filePath, sheet.title))
-                    continue
-
-                # this test is to remove the first column and the first row if B1==0, no r-table should have B1==0, so this means that the r-table starts at B2
-                if r_tb.iloc[0, 1] == 0:
-                    print("This format is no longer supported, please use the new format, bare r-tables that should start at A1 adn end at T29 in excel file.")
-                    sys.exit(1)
-
-                # add the r-table to the list
-                r_tables.append(r_tb)
-                r_tables_names.append(sheet)
-
-    # if there are no r-tables, return the info to the user and exit
-    if len(r_tables) == 0:
-        print('No r-tables found in %s that match %s /%s' % (folderPath, patron, sheets))
-        return 0
-    
-    if verbose:
-        print("Done, data loaded successfully, found " + str(len(r_tables)) + " r-table(s).\n")
-    
+    #the data is loaded lazily: each workbook is parsed once, or loaded from the cache if it was parsed by an earlier run,
+    #over several processes if the user asked for it, the tables come in the order of the files and sheets
+    rtableIterator = profiler.iterate('loading', iterRtables(fileList, sheets, ignore, cacheFolder, jobs, verbose))
+
     # ----------------------------------
     # ---------- PROCESS DATA ----------
     # ----------------------------------
 
-    #convert the r_table from lists to numpy arrays
-    r_tables = [r_table.to_numpy() for r_table in r_tables]
-
-    #convert the stops to a partition
-    if stops != 'none':
-        partition = stopsToPartition(stops)
-    elif partition != 'none':
-        try:
-            file, sheet = partition.split(',')
-            partition = loadPartition(os.path.join('../', file), sheet)
-        except ValueError:
-            print("Error: partition is not a valid partition or a valid file and sheet name, please check the documentation for more information.")
-            sys.exit(1)
-
-    #get the number of ellipsoids
-    nEll = np.unique(partition).size
-    nCoefs = 5
-    if freeConstant:
-        nCoefs += 1
-
-    #load the weights for the Q0 function
-    Q0_weights = pd.read_excel('Q0_weights.xlsx', header=None)
+    #the partition, the number of ellipsoids and the weights of Q0 are the partition setup stage
+    with profiler.stage('partition setup'):
+        #convert the stops to a partition
+        if stops != 'none':
+            partition = stopsToPartition(stops)
+        elif partition != 'none':
+            try:
+                file, sheet = partition.split(',')
+                partition = loadPartition(os.path.join('../', file), sheet)
+            except ValueError:
+                print("Error: partition is not a valid partition or a valid file and sheet name, please check the documentation for more information.")
+                sys.exit(1)
+
+        #get the number of ellipsoids
+        nEll = np.unique(partition).size
+        nCoefs = 5
+        if freeConstant:
+            nCoefs += 1
+
+        #load the weights for the Q0 function
+        Q0_weights = loadQ0Weights('Q0_weights.xlsx')
 
     if verbose:
         if ellipsoidAdjusting:
             print("Starting ellipsoid adjusting algorithm using stops " + str(stops) + "...")
         elif betaGeneticAlgorithm:
             print("Starting beta genetic algorithm...")
+        elif betaExhaustiveSearch:
+            print("Starting beta exhaustive search...")
         elif partitioningGeneticAlgorithm:
             print("Starting partitioning genetic algorithm...")
 
-    #plot Original r-tables if needed
-    if 'o' in plotTypes:
-        #plot the original r-tables
-        for i, r_table in enumerate(r_tables):
-            plotRtable(r_table, partition, beta, epsilon, name= r_tables_names[i], \
-                        store=saveImages, show=showImages, style=plotStyle, coloredOT=coloredOT, verbose=verbose)
+    #the genetic algorithms need all the tables at once
+    if not ellipsoidAdjusting:
+        r_tables = []
+        r_tables_names = []
+        for name, filePath, r_tb in rtableIterator:
+            # add the r-table to the list
+            r_tables.append(r_tb)
+            r_tables_names.append(name)
+
+        # if there are no r-tables, return the info to the user and exit
+        if len(r_tables) == 0:
+            print('No r-tables found in %s that match %s /%s' % (folderPath, patron, sheets))
+            return 0
+
+        if verbose:
+            print("Done, data loaded successfully, found " + str(len(r_tables)) + " r-table(s).\n")
+
+        #plot Original r-tables if needed
+        if 'o' in plotTypes:
+            #plot the original r-tables
+            for i, r_table in enumerate(r_tables):
+                with profiler.stage('plotting'):
+                    plotRtable(r_table, partition, beta, epsilon, name= r_tables_names[i], \
+                                store=saveImages, show=showImages, style=plotStyle, coloredOT=coloredOT, verbose=verbose)
+
+        #the tables found several times are only fitted once, with a weight of their number of copies, the fitness values do not change
+        nTables = len(r_tables)
+        weights = None
+        if not noDeduplication:
+            firsts, inverse, counts = uniqueRtables(r_tables)
+            if len(firsts) < nTables:
+                print("Found " + str(nTables - len(firsts)) + " duplicate r-table(s), " + str(len(firsts)) + " distinct r-table(s) are fitted.")
+                r_tables = [r_tables[i] for i in firsts]
+                weights = counts
+
+        #the tables are kept in a single (N, 29, 20) stack, in single precision if the user asked for it
+        r_tables = stackRtables(r_tables, float32)
+
+        #the genetic algorithms can search over a few representative tables only, each one with the weight of its cluster
+        representativeTables = None
+        searchTables, searchWeights = r_tables, weights
+        if (betaGeneticAlgorithm or partitioningGeneticAlgorithm) and 0 < representatives < len(r_tables):
+            with profiler.stage('clustering'):
+                medoids, searchWeights, clusters = clusterRtables(r_tables, representatives, weights)
+            representativeTables = searchTables = r_tables[medoids]
+            print("The genetic algorithms search over " + str(len(medoids)) + " representative r-tables of the " + str(len(r_tables)) + " distinct r-table(s).")
 
     # ---------------------------------------------------------
     # ------------- ELLIPSOID ADJUSTING ALGORITHM -------------
     # ---------------------------------------------------------
 
     if ellipsoidAdjusting:
-        #run the ellipsoid adjusting algorithm
-        results = np.zeros_like(r_tables)
-        data = pd.DataFrame(columns=['r-table', 'S1', 'Q0', 'Q0_trapezes', 'Qd_trapezes', 'smoothness','entropy',\
+        #run the ellipsoid adjusting algorithm, the tables are streamed chunk by chunk (all at once by default)
+        #so only one chunk of tables is in memory at a time
+        rows = []
+        ellipsoidCoeffs = []
+        r_tables_names = []
+        writer = None
+
+        #the tables are spread over jobs processes, the images can only be shown one after another from this process
+        adjustJobs = 1 if showImages else jobs
+        pool = adjustingPool(adjustJobs)
+
+        #only the adjusting itself is timed, not the loading of the tables nor the writing of the results
+        adjustingTime = 0
+        for names, filePaths, r_tables in iterRtableChunks(rtableIterator, chunkSize, float32):
+
+            #the tables of the chunk found several times are only adjusted once, and their results are copied back to every copy
+            #(unless there are plots to make, they are made for every name)
+            firsts, inverse = np.arange(len(r_tables)), None
+            if not noDeduplication and plotTypes == '':
+                firsts, inverse, counts = uniqueRtables(r_tables)
+                if len(firsts) == len(r_tables):
+                    inverse = None
+                elif verbose:
+                    print("Found " + str(len(r_tables) - len(firsts)) + " duplicate r-table(s) in this chunk, they are adjusted once.")
+
+            start = time.time()
+            vs, results, chunkRows = adjustRtablesParallel(pool, adjustJobs, r_tables[firsts], [names[i] for i in firsts], partition, beta, epsilon, Q0_weights, \
+                                                        freeConstant=freeConstant, conserveZeros=conserveZeros, plotTypes=plotTypes, \
+                                                        saveImages=saveImages, showImages=showImages, plotStyle=plotStyle, coloredOT=coloredOT, verbose=verbose, \
+                                                        profiler=profiler)
+            adjustingTime += time.time() - start
+            if inverse is not None:
+                vs, results = vs[inverse], results[inverse]
+                chunkRows = [[name] + chunkRows[j][1:] for name, j in zip(names, inverse)]
+            ellipsoidCoeffs.append(vs.reshape(len(r_tables), nEll*nCoefs))
+            rows += chunkRows
+
+            #store all the results in the same excel file in different sheets corresponding to the r-tables names,
+            #the workbook is write only: the sheets of each chunk are streamed to temporary files as soon as the chunk is done
+            #and are not kept in memory until the end
+            if saveData:
+                with profiler.stage('writing'):
+                    if writer is None:
+                        writer = Workbook(write_only=True)
+                    for i, r_table in enumerate(results):
+                        sheet = writer.create_sheet(names[i])
+                        for row in np.round(r_table, 1).tolist():
+                            sheet.append(row)
+
+            r_tables_names += names
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        if writer is not None:
+            with profiler.stage('writing'):
+                writer.save(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '_adjustedTables.xlsx'))
+
+        # if there are no r-tables, return the info to the user and exit
+        if len(r_tables_names) == 0:
+            print('No r-tables found in %s that match %s /%s' % (folderPath, patron, sheets))
+            return 0
+
+        data = pd.DataFrame(rows, columns=['r-table', 'S1', 'Q0', 'Q0_trapezes', 'Qd_trapezes', 'smoothness','entropy',\
                                         'S1_adj', 'Q0_adj', 'Q0_trapezes_adj', 'Qd_trapezes_adj', 'smoothness_adj','entropy_adj',\
-                                        'deltaR','deltaQ0S1','RMSE'], index=np.arange(len(r_tables)))
-        
-        ellipsoidCoeffs = np.zeros((len(r_tables), nEll*nCoefs))
+                                        'deltaR','deltaQ0S1','RMSE'], index=np.arange(len(rows)))
+        ellipsoidCoeffs = np.concatenate(ellipsoidCoeffs)
 
-        start = time.time()
-        for i, r_table in enumerate(r_tables):
-            if verbose:
-                print("Treating " + r_tables_names[i])
-            v = ellipsoidFitting(r_table, partition, beta, epsilon, freeConstant=freeConstant)
-            ellipsoidCoeffs[i] = np.array(v).flatten()
-            r_table_adj = rebuildRtable(v, partition, beta, epsilon, request = 'cols', verbose=False)#verbose here for debugging only
-            
-            #any 0 in the original r-table will be put at 0 in the adjusted r-table
-            if conserveZeros:
-                r_table_adj[r_table == 0] = 0
-
-            results[i] = r_table_adj
-
-            if 'r' in plotTypes:
-                plotRtable(r_table_adj, partition, beta, epsilon, name= 'adjusted ' + r_tables_names[i], \
-                    store=saveImages, show=showImages, style=plotStyle, coloredOT = True, verbose=False)#"verbose here for debugging onl"
-                
-            if 'c' in plotTypes:
-                plotRtableCompare(r_table, r_table_adj, partition, beta, epsilon, name= 'comparing ' + r_tables_names[i], \
-                    store=saveImages, show=showImages, style=plotStyle, verbose=False)#"
-        
-            data.iloc[i] = [r_tables_names[i], S1(r_table), Q0(r_table, Q0_weights), Q0_Trapezes(r_table), Qd(r_table,Q0_weights), Smoothness(r_table), Entropy(r_table), \
-                            S1(r_table_adj), Q0(r_table_adj, Q0_weights), Q0_Trapezes(r_table_adj), Qd(r_table_adj,Q0_weights), Smoothness(r_table_adj), Entropy(r_table_adj), \
-                            deltaR(r_table, r_table_adj), deltaQ0S1(r_table, r_table_adj), RMSE(r_table, r_table_adj)]
-        stop = time.time()
-        
-        print("Ellipsoid adjusting algorithm for %s r-tables took %s seconds" % (len(r_tables), round(stop-start, 2)))
+        print("Ellipsoid adjusting algorithm for %s r-tables took %s seconds" % (len(r_tables_names), round(adjustingTime, 2)))
         print("Found mean deltaR (MDR) of %s" % (np.mean(data['deltaR'])))
 
         if saveData:
-            if verbose:
-                print("Saving results data to " + saveFolder + "/" + saveDataName)
-                print("Saving ellipsoid coefficients to " + saveFolder + "/" + saveDataName + "_ellipsoidCoeffs")
-            data.to_excel(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '.xlsx'))
-
-            #store all the results in the same excel file in different sheets corresponding to the r-tables names
-            with pd.ExcelWriter(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '_adjustedTables.xlsx')) as writer:
-                for i, r_table in enumerate(results):
-                    dataF = pd.DataFrame(r_table)
-                    dataF = dataF.round(1)
-                    dataF.to_excel(writer, sheet_name=r_tables_names[i], header=False, index=False)
-
-            #save the ellipsoid coefficients
-            ellipsoidCoeffs = pd.DataFrame(ellipsoidCoeffs)
-            #add a column with the r-table names
-            ellipsoidCoeffs['r-table'] = r_tables_names
-            #move the r-table column to the front
-            cols = list(ellipsoidCoeffs.columns)
-            cols = [cols[-1]] + cols[:-1]
-            ellipsoidCoeffs = ellipsoidCoeffs[cols]
-            ellipsoidCoeffs.to_excel(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '_ellipsoidCoeffs.xlsx'))
-
-            #save a txt file with the command line arguments
-            with open(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '_commandLineArguments.txt'), 'w') as f:
-                f.write(' '.join(sys.argv[1:]))
+            with profiler.stage('writing'):
+                if verbose:
+                    print("Saving results data to " + saveFolder + "/" + saveDataName)
+                    print("Saving ellipsoid coefficients to " + saveFolder + "/" + saveDataName + "_ellipsoidCoeffs")
+                data.to_excel(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '.xlsx'))
+
+                #save the ellipsoid coefficients
+                ellipsoidCoeffs = pd.DataFrame(ellipsoidCoeffs)
+                #add a column with the r-table names
+                ellipsoidCoeffs['r-table'] = r_tables_names
+                #move the r-table column to the front
+                cols = list(ellipsoidCoeffs.columns)
+                cols = [cols[-1]] + cols[:-1]
+                ellipsoidCoeffs = ellipsoidCoeffs[cols]
+                ellipsoidCoeffs.to_excel(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '_ellipsoidCoeffs.xlsx'))
+
+                #save a txt file with the command line arguments
+                with open(os.path.join(saveFolder, folderPath.split('/')[-1] + '_' + saveDataName + '_commandLineArguments.txt'), 'w') as f:
+                    f.write(' '.join(sys.argv[1:]))
 
     # ---------------------------------------------------------
     # ------------------ BETA GENETIC ALGORITHM ---------------
@@ -279,10 +346,27 @@ def main():
 
     if betaGeneticAlgorithm:
         start = time.time()
-        bestBeta, smallestMRMSE = fitBetaGenetic(r_tables, beta, epsilon, nEll=genetics[0], nMaxGen=genetics[1], nIndiv=genetics[2], verbose=verbose)
+        #the checkpoints of the run are saved in the save folder
+        checkpoint = os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + '_' + str(genetics[0]) + '_bga_checkpoint.pkl')
+        try:
+            bestBeta, smallestMRMSE = fitBetaGenetic(searchTables, beta, epsilon, nEll=genetics[0], nMaxGen=genetics[1], nIndiv=genetics[2], verbose=verbose, fitnessCache=fitnessCache, \
+                                                    profiler=profiler, checkpoint=checkpoint, checkpointEvery=checkpointEvery, resume=resume, \
+                                                    islands=islands, migrationInterval=migrationInterval, nMigrants=migrants, stopping=stopping, \
+                                                    screening=screening, screeningTables=screeningTables, batchSize=batchSize, weights=searchWeights, \
+                                                    backend=backend)
+        except ValueError as e:
+            print("Error: " + str(e))
+            sys.exit(1)
+        #a partition found over the representative tables is scored again over all the tables, this is the deltaR reported
+        if representativeTables is not None:
+            with profiler.stage('validation'):
+                representativeMRMSE = smallestMRMSE
+                smallestMRMSE = fitness(bestBeta, r_tables, beta, epsilon, weights=weights)
+            print("Mean deltaR over the " + str(len(representativeTables)) + " representative r-tables: " + str(representativeMRMSE) + \
+                  ", over all the r-tables: " + str(smallestMRMSE))
         stop = time.time()
         if verbose:
-            print("Beta genetic algorithm for %s r-tables took %s seconds" % (len(r_tables), round(stop-start, 4)))
+            print("Beta genetic algorithm for %s r-tables took %s seconds" % (nTables, round(stop-start, 4)))
 
         print("Best beta partition: " + str(partitionToStops(bestBeta)))
         print("With a Mean deltaR (MDR) of " + str(smallestMRMSE))
@@ -291,16 +375,62 @@ def main():
             f.write(str(folderPath.split('/')[-1]) + ': Best beta partition for ' + str(genetics[0]) + ' ellipsoids: ' + str(partitionToStops(bestBeta)) + '\n'\
                     + '(Took ' + str(round(stop-start, 4)) + ' seconds)\n')
 
+    # ---------------------------------------------------------
+    # ------------------ BETA EXHAUSTIVE SEARCH ---------------
+    # ---------------------------------------------------------
+
+    if betaExhaustiveSearch:
+        start = time.time()
+        bestBeta, smallestMRMSE, ranking = fitBetaExhaustive(r_tables, beta, epsilon, nEll=genetics[0], verbose=verbose, fitnessCache=fitnessCache, profiler=profiler, \
+                                                             weights=weights, backend=backend)
+        stop = time.time()
+        if verbose:
+            print("Beta exhaustive search over %s stops vectors for %s r-tables took %s seconds" % (len(ranking), nTables, round(stop-start, 4)))
+            print("The 10 best stops vectors:")
+            for stopsVector, mdr in ranking[:10]:
+                print(str(stopsVector) + ": " + str(mdr))
+
+        #the stops vector itself is reported, it is the one that gives the best partition with stopsToPartition
+        print("Best beta partition: " + str(ranking[0][0]))
+        print("With a Mean deltaR (MDR) of " + str(smallestMRMSE))
+
+        with open(os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + '_bestBeta.txt'), 'a') as f:
+            f.write(str(folderPath.split('/')[-1]) + ': Best beta partition for ' + str(genetics[0]) + ' ellipsoids (exhaustive search): ' + str(ranking[0][0]) + '\n'\
+                    + '(Took ' + str(round(stop-start, 4)) + ' seconds)\n')
+
+        if saveData:
+            #save the full ranking of the stops vectors
+            rankingData = pd.DataFrame({'stops': [','.join(str(int(stop)) for stop in stopsVector) for stopsVector, mdr in ranking], \
+                                        'deltaR': [mdr for stopsVector, mdr in ranking]})
+            rankingData.to_excel(os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + '_' + str(genetics[0]) + '_betaRanking.xlsx'))
+
     # ---------------------------------------------------------
     # ------------ PARTITIONING GENETIC ALGORITHM -------------
     # ---------------------------------------------------------
 
     if partitioningGeneticAlgorithm:
         start = time.time()
-        bestPartition, smallestMRMSE = fitPartitionGenetic(r_tables, beta, epsilon, nEll=genetics[0], nMaxGen=genetics[1], nIndiv=genetics[2], verbose=verbose)
+        #the checkpoints of the run are saved in the save folder
+        checkpoint = os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + '_' + str(genetics[0]) + '_pga_checkpoint.pkl')
+        try:
+            bestPartition, smallestMRMSE = fitPartitionGenetic(searchTables, beta, epsilon, nEll=genetics[0], nMaxGen=genetics[1], nIndiv=genetics[2], verbose=verbose, fitnessCache=fitnessCache, \
+                                                                profiler=profiler, checkpoint=checkpoint, checkpointEvery=checkpointEvery, resume=resume, \
+                                                                islands=islands, migrationInterval=migrationInterval, nMigrants=migrants, stopping=stopping, \
+                                                                screening=screening, screeningTables=screeningTables, batchSize=batchSize, weights=searchWeights, \
+                                                                backend=backend)
+        except ValueError as e:
+            print("Error: " + str(e))
+            sys.exit(1)
+        #a partition found over the representative tables is scored again over all the tables, this is the deltaR reported
+        if representativeTables is not None:
+            with profiler.stage('validation'):
+                representativeMRMSE = smallestMRMSE
+                smallestMRMSE = fitness(bestPartition, r_tables, beta, epsilon, weights=weights)
+            print("Mean deltaR over the " + str(len(representativeTables)) + " representative r-tables: " + str(representativeMRMSE) + \
+                  ", over all the r-tables: " + str(smallestMRMSE))
         stop = time.time()
         if verbose:
-            print("Partitioning genetic algorithm for %s r-tables took %s seconds" % (len(r_tables), round(stop-start, 4)))
+            print("Partitioning genetic algorithm for %s r-tables took %s seconds" % (nTables, round(stop-start, 4)))
 
         print("Best deltaR: " + str(smallestMRMSE))
 
@@ -320,5 +450,9 @@ def main():
             pd.DataFrame(bestPartition).to_excel(os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + 'bestPartitions.xlsx')\
                                                 , header=False, index=False, sheet_name= str(genetics[0]) + '_ell')
 
+    #the time spent in each stage, if the user asked for it
+    profiler.finish(os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + '_profile.txt'), \
+                    os.path.join(saveFolder, saveDataName + '_' + folderPath.split('/')[-1] + '.prof'))
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,104 @@
+import numpy as np
+import multiprocessing as mp
+
+from ellipsoidFitting import ellipsoidFittingBatch
+from rebuildRtable import rebuildRtableBatch
+from plotRtables import plotRtable, plotRtableCompare
+from profiler import Profiler
+
+from extractData import S1Batch, Q0Batch, QdBatch, Q0_TrapezesBatch, SmoothnessBatch, EntropyBatch, RMSEBatch, OriginalMetrics
+
+# The ellipsoid adjusting algorithm for a stack of r-tables: fitting, rebuilding, scoring and plotting
+# Every table is independent from the others, so the stack can be cut in slices handled by several processes,
+# the slices are put back together in order and give exactly the same results as a single process
+
+def adjustRtables(r_tables, names, partition, beta, epsilon, Q0_weights, freeConstant=False, conserveZeros=False, \
+                  plotTypes='', saveImages=False, showImages=False, plotStyle='2D_side', coloredOT=True, verbose=False, profiler=None):
+    #r_tables is a stack of shape (N, 29, 20), the stages are timed by the profiler if one is given
+    #returns the coefficients (N, nEll, k), the adjusted r-tables (N, 29, 20) and one row of metrics per table
+
+    if profiler is None:
+        profiler = Profiler()
+
+    #plot Original r-tables if needed
+    if 'o' in plotTypes:
+        for i, r_table in enumerate(r_tables):
+            with profiler.stage('plotting'):
+                plotRtable(r_table, partition, beta, epsilon, name= names[i], \
+                            store=saveImages, show=showImages, style=plotStyle, coloredOT=coloredOT, verbose=verbose)
+
+    #the adjusted values are never rounded to the type of the original tables (integer or single precision ones)
+    results = np.zeros(r_tables.shape)
+
+    #fit the ellipsoids of every table at once
+    with profiler.stage('fitting'):
+        vs = ellipsoidFittingBatch(r_tables, partition, beta, epsilon, freeConstant=freeConstant)
+
+    #and rebuild them all at once too
+    with profiler.stage('rebuild'):
+        r_tables_adj = rebuildRtableBatch(vs, partition, beta, epsilon, request = 'cols', verbose=False)#verbose here for debugging only
+
+    for i, r_table in enumerate(r_tables):
+        if verbose:
+            print("Treating " + names[i])
+        r_table_adj = r_tables_adj[i]
+
+        #any 0 in the original r-table will be put at 0 in the adjusted r-table
+        if conserveZeros:
+            r_table_adj[r_table == 0] = 0
+
+        results[i] = r_table_adj
+
+        if 'r' in plotTypes or 'c' in plotTypes:
+            with profiler.stage('plotting'):
+                if 'r' in plotTypes:
+                    plotRtable(r_table_adj, partition, beta, epsilon, name= 'adjusted ' + names[i], \
+                        store=saveImages, show=showImages, style=plotStyle, coloredOT = True, verbose=False)#"verbose here for debugging onl"
+
+                if 'c' in plotTypes:
+                    plotRtableCompare(r_table, r_table_adj, partition, beta, epsilon, name= 'comparing ' + names[i], \
+                        store=saveImages, show=showImages, style=plotStyle, verbose=False)#"
+
+    #the coefficients of every table, the original ones are computed once and reused for the comparisons
+    with profiler.stage('metrics'):
+        original = OriginalMetrics(r_tables)
+        columns = [original.S1, Q0Batch(r_tables, Q0_weights), original.Q0_Trapezes, QdBatch(r_tables, Q0_weights), SmoothnessBatch(r_tables), EntropyBatch(r_tables), \
+                    S1Batch(r_tables_adj), Q0Batch(r_tables_adj, Q0_weights), Q0_TrapezesBatch(r_tables_adj), QdBatch(r_tables_adj, Q0_weights), \
+                    SmoothnessBatch(r_tables_adj), EntropyBatch(r_tables_adj), \
+                    original.deltaR(r_tables, r_tables_adj), original.deltaQ0S1(r_tables, r_tables_adj), RMSEBatch(r_tables, r_tables_adj)]
+        rows = [[names[i]] + [float(column[i]) for column in columns] for i in range(len(r_tables))]
+
+    return vs, results, rows
+
+def adjustTask(task):
+    #adjustRtables for a worker process, the task holds the positional and keyword arguments
+    args, kwargs = task
+    return adjustRtables(*args, **kwargs)
+
+def adjustRtablesParallel(pool, jobs, r_tables, names, *args, profiler=None, **kwargs):
+    #same as adjustRtables, with the stack cut in slices spread over the processes of the pool
+    #a few slices per process so that a process with slow tables (plots) does not hold the others back
+    #the stages of the worker processes can not be timed one by one, their whole work is the 'adjusting (workers)' stage
+    if pool is None or jobs <= 1 or len(r_tables) <= 1:
+        return adjustRtables(r_tables, names, *args, profiler=profiler, **kwargs)
+
+    if profiler is None:
+        profiler = Profiler()
+
+    bounds = np.linspace(0, len(r_tables), min(4*jobs, len(r_tables)) + 1).astype(int)
+    tasks = [((r_tables[start:stop], names[start:stop]) + args, kwargs) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    #map keeps the order of the slices, whatever order the processes finish in
+    with profiler.stage('adjusting (workers)'):
+        outputs = pool.map(adjustTask, tasks)
+
+    vs = np.concatenate([output[0] for output in outputs])
+    results = np.concatenate([output[1] for output in outputs])
+    rows = [row for output in outputs for row in output[2]]
+    return vs, results, rows
+
+def adjustingPool(jobs):
+    #the pool of processes of the ellipsoid adjusting algorithm, None if it runs in a single process
+    if jobs <= 1:
+        return None
+    return mp.Pool(processes=jobs)
@@ -1,61 +1,91 @@
 import numpy as np
 
 def ellipsoidFitting(data, partition, beta, epsilon, freeConstant =False):
+    #a single table is just a stack of one table
+    return ellipsoidFittingBatch(np.asarray(data, dtype=float)[np.newaxis], partition, beta, epsilon, freeConstant)[0]
 
-    beta = beta * np.pi/180
-    nEllipsoids = len(np.unique(partition))
+def designMatrices(r_tables, beta, epsilon, freeConstant =False):
+    #r_tables is a stack of tables of shape (N, 29, 20), the design matrix of every cell of every table
+    #is built in one go, returns D of shape (N, 29, 20, 5+freeConstant) and the norms of shape (N, 29, 20)
+    betaRad = beta * np.pi/180
 
-    #the data points in each group, lists can be up to 580 long
-    dataGroups = [[] for i in range(nEllipsoids)]
-    dataBetas = [[] for i in range(nEllipsoids)]
-    dataEpsilons = [[] for i in range(nEllipsoids)]
+    sinEpsilon = np.sin(epsilon)[:, np.newaxis]
+    cosEpsilon = np.cos(epsilon)[:, np.newaxis]
 
-    #each group is a list of the data points in that group, and the corresponding beta and tan epsilon (580 loop)
-    for i, j in np.ndindex(data.shape):
-        dataGroups[int(partition[i,j])-1].append(data[i,j])
-        dataBetas[int(partition[i,j])-1].append(beta[j])
-        dataEpsilons[int(partition[i,j])-1].append(epsilon[i])
-            
-    #by default, we have 5 parameters per ellipsoid (see the paper), but we can add more,
-    #for example to allow for a free y parameter or to allow for ellipsoids that have a y component
-    v = np.zeros((nEllipsoids, 5 + freeConstant))
+    #fill the points vector
+    X = r_tables * sinEpsilon * np.cos(betaRad)
+    Y = r_tables * sinEpsilon * np.sin(betaRad)
+    Z = r_tables * cosEpsilon
 
-    for index, group in enumerate(dataGroups):
-        
-        N = len(group)
+    norms = X**2 + Y**2 + Z**2
 
-        #the data points in this group
-        betas = np.array(dataBetas[index])
-        epsilons = np.array(dataEpsilons[index])
+    #the matrix D, one line per cell
+    D = np.zeros(r_tables.shape + (5 + freeConstant,))
 
-        #fill the points vector    
-        X = group * np.sin(epsilons) * np.cos(betas)
-        Y = group * np.sin(epsilons) * np.sin(betas)
-        Z = group * np.cos(epsilons)
+    #fill the matrix D following the paper
+    D[...,0] = X**2 + Y**2 - 2*Z**2
+    D[...,1] = X**2 + Z**2 - 2*Y**2
+    D[...,2] = 2*X*Z
+    D[...,3] = 2*X
+    D[...,4] = 2*Z
 
-        norms = X**2 + Y**2 + Z**2
+    #adding more parameters to the ellipsoid
+    if freeConstant:
+        D[...,5] = 1
 
-        #the matrix D
-        D = np.zeros((N, 5 + freeConstant))
+    return D, norms
 
-        #fill the matrix D following the paper
-        D[:,0] = X**2 + Y**2 - 2*Z**2
-        D[:,1] = X**2 + Z**2 - 2*Y**2
-        D[:,2] = 2*X*Z
-        D[:,3] = 2*X
-        D[:,4] = 2*Z
+def solveNormalEquations(DTD, DTnorms):
+    #solves all the small systems DTD v = DTnorms at once, DTD is (..., k, k) and DTnorms is (..., k)
+    #this is the least squares solution np.linalg.lstsq(DTD, DTnorms, rcond = None) gives, computed with a batched SVD:
+    #the normal matrices can be very badly conditioned (or singular for a group of zeros), so the small singular values
+    #are cut off exactly like lstsq does instead of being inverted by a plain solve
+    #the normal matrices are summed in another order than the original per group np.dot, the coefficients agree with the
+    #original lstsq to about 1e-9 relative at worst, but on a group of a single beta column (stops like 0, 2, ...) the rebuilt
+    #ellipsoid can almost vanish on a cell (the denominator A of rebuildCells close to 0), the r value of that cell then
+    #depends on the last digits of the coefficients and the deltaR of the partition can differ from the original code by a few
+    #percent (1.4206 against 1.4044 for the stops 0, 2, 165, 180 on WetCond001_049), which is also how much the original code's
+    #own deltaR moves when the tables are changed by 1e-13, so neither value is more right than the other
+    U, s, Vh = np.linalg.svd(DTD)
+    cutoff = np.finfo(float).eps * DTD.shape[-1] * s[..., :1]
+    sInv = np.divide(1, s, out=np.zeros_like(s), where=s > cutoff)
+    UTnorms = np.matmul(np.swapaxes(U, -1, -2), DTnorms[..., np.newaxis])[..., 0]
+    return np.matmul(np.swapaxes(Vh, -1, -2), (sInv * UTnorms)[..., np.newaxis])[..., 0]
 
-        #adding more parameters to the ellipsoid
-        if freeConstant:
-            D[:,5] = 1
+def cellStatistics(r_tables, beta, epsilon, freeConstant =False):
+    #the contribution of each cell of each table to DTD and DTnorms does not depend on the partition,
+    #so it is computed once for a whole database: (N, 580, k, k) and (N, 580, k)
+    r_tables = np.asarray(r_tables, dtype=float)
+    D, norms = designMatrices(r_tables, beta, epsilon, freeConstant)
 
-        #the matrices for the least squares solution
-        DTD = np.dot(D.T, D)
-        DTnorms = np.dot(D.T, norms)
+    #flatten the cells, (N, 580, k) and (N, 580)
+    D = D.reshape(len(r_tables), -1, D.shape[-1])
+    norms = norms.reshape(len(r_tables), -1)
 
-        #least squares solution
-        v[index] = np.linalg.lstsq(DTD, DTnorms, rcond = None)[0]
-        
-    return v
+    cellDTD = D[..., :, np.newaxis] * D[..., np.newaxis, :]
+    cellDTnorms = D * norms[..., np.newaxis]
+    return cellDTD, cellDTnorms
 
+def groupStatistics(cellDTD, cellDTnorms, partition):
+    #sums the cell statistics over each group of the partition, (N, nEllipsoids, k, k) and (N, nEllipsoids, k)
+    #the groups are numbered from 1 to the largest region number, a number missing from the partition
+    #(a region lost by a mutation) is an empty group whose coefficients are 0
+    nEllipsoids = int(np.max(partition))
+    k = cellDTnorms.shape[-1]
 
+    #membership of each cell to each group, (nEllipsoids, 580)
+    groups = np.asarray(partition).astype(int).flatten() - 1
+    membership = (groups == np.arange(nEllipsoids)[:, np.newaxis]) * 1.0
+
+    DTD = np.matmul(membership, cellDTD.reshape(len(cellDTD), -1, k*k)).reshape(len(cellDTD), nEllipsoids, k, k)
+    DTnorms = np.matmul(membership, cellDTnorms)
+    return DTD, DTnorms
+
+def ellipsoidFittingFromStatistics(cellDTD, cellDTnorms, partition):
+    #fitting any partition is only a sum over its groups and a batch of small solves
+    return solveNormalEquations(*groupStatistics(cellDTD, cellDTnorms, partition))
+
+def ellipsoidFittingBatch(r_tables, partition, beta, epsilon, freeConstant =False):
+    #fits the ellipsoids of one partition to a whole stack of r-tables of shape (N, 29, 20)
+    #returns the coefficients in an array of shape (N, nEllipsoids, 5+freeConstant)
+    return ellipsoidFittingFromStatistics(*cellStatistics(r_tables, beta, epsilon, freeConstant), partition)
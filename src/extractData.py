@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 
 #This script contains the functions to extract the standard coefficients from the R-table S1, Q0 and Qd
 beta = np.array([0, 2, 5, 10, 15, 20, 25, 30, 35, 40, 45, 60, 75, 90, 105, 120, 135, 150, 165, 180])
@@ -6,51 +7,69 @@ tanEpsilon = np.array([0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 2.5, 3, 3.5, 4
 sinEpsilon = np.sin(np.arctan(tanEpsilon))
 Epsilon = np.arctan(tanEpsilon)
 
+# Every coefficient has a batch version that works on a stack of r-tables of shape (N, 29, 20) and returns an array of shape (N,),
+# the functions for a single table are just a stack of one table
+# The weights of Q0 and Qd are a plain (29, 20) array, see loadQ0Weights
+
+def loadQ0Weights(filePath='Q0_weights.xlsx'):
+    #the weights of the Q0 and Qd functions, as a (29, 20) array
+    return pd.read_excel(filePath, header=None).to_numpy(dtype=float)
+
 def S1(r_tb):
-    return r_tb[8,0] / r_tb[0,0]
+    return S1Batch(np.asarray(r_tb)[np.newaxis])[0]
+
+def S1Batch(r_tables):
+    return r_tables[:,8,0] / r_tables[:,0,0]
 
 def mean(r_tb):
-    return np.sum(np.sum(r_tb)) / 580
+    return meanBatch(np.asarray(r_tb)[np.newaxis])[0]
+
+def meanBatch(r_tables):
+    #summed in double precision, whatever the precision of the tables
+    return np.sum(np.reshape(r_tables, (len(r_tables), -1)), axis=-1, dtype=float) / 580
 
 def Q0(r_tb, weights):
-    #create a matrix where everyline is tanEpsilon, with 20 lines
-    tanEpsilonMatrix = np.repeat(tanEpsilon, 20).reshape(29,20)
+    return Q0Batch(np.asarray(r_tb)[np.newaxis], weights)[0]
 
-    Q0m = np.multiply(r_tb, tanEpsilonMatrix)
-    Q0m = np.multiply(Q0m, weights)
-    Q0 = np.sum(np.sum(Q0m))
+def Q0Batch(r_tables, weights):
+    #every line of the tables is multiplied by tanEpsilon and by the weights
+    Q0m = r_tables * tanEpsilon[:, np.newaxis] * np.asarray(weights)
+    Q0 = np.sum(np.sum(Q0m, axis=-2), axis=-1)
     Q0 /= 9.936e7
     return Q0
 
 def Qd(r_tb, weights):
-    #create a matrix where everyline is sinEpsilon, with 20 lines
-    sinEpsilonMatrix = np.repeat(sinEpsilon, 20).reshape(29,20)
+    return QdBatch(np.asarray(r_tb)[np.newaxis], weights)[0]
 
-    QDm = np.multiply(r_tb, sinEpsilonMatrix)
-    QDm = np.multiply(QDm, weights)
-    QD = np.sum(np.sum(QDm))
+def QdBatch(r_tables, weights):
+    #every line of the tables is multiplied by sinEpsilon and by the weights
+    QDm = r_tables * sinEpsilon[:, np.newaxis] * np.asarray(weights)
+    QD = np.sum(np.sum(QDm, axis=-2), axis=-1)
     QD /= 6.097e7
     return QD
 
 # This is a translation of some matlab code from Vincent Boucher to python :)
 def Q0_Trapezes(r_tb):
+    return Q0_TrapezesBatch(np.asarray(r_tb)[np.newaxis])[0]
+
+def Q0_TrapezesBatch(r_tables):
     #load the weights from file and get the values for q
-    q1 = r_tb[:, 1:] / (np.cos(Epsilon[:, np.newaxis]) ** 3) / 1e4
-    q2 = r_tb[:, :-1] / (np.cos(Epsilon[:, np.newaxis]) ** 3) / 1e4
-    
+    q1 = r_tables[..., 1:] / (np.cos(Epsilon[:, np.newaxis]) ** 3) / 1e4
+    q2 = r_tables[..., :-1] / (np.cos(Epsilon[:, np.newaxis]) ** 3) / 1e4
+
     # Calculate the integral using the trapeze method
-    N = np.sum(np.sin(Epsilon[:, np.newaxis]) * (q1 + q2) / 2 * np.diff(beta), axis=1)
-    
-    # Calculate the integral of the denominator 
-    omega1 = (r_tb[:, 1:] != 0) * 1
-    omega2 = (r_tb[:, :-1] != 0) * 1
+    N = np.sum(np.sin(Epsilon[:, np.newaxis]) * (q1 + q2) / 2 * np.diff(beta), axis=-1)
+
+    # Calculate the integral of the denominator
+    omega1 = (r_tables[..., 1:] != 0) * 1
+    omega2 = (r_tables[..., :-1] != 0) * 1
 
     # Compute the sum over the angles for the denominator
-    D = np.sum(np.sin(Epsilon[:, np.newaxis]) * (omega1 + omega2) / 2 * np.diff(beta), axis=1)
-    
+    D = np.sum(np.sin(Epsilon[:, np.newaxis]) * (omega1 + omega2) / 2 * np.diff(beta), axis=-1)
+
     # final sum along the angles
-    N2 = np.sum((N[1:] + N[:-1]) / 2 * np.diff(Epsilon))
-    D2 = np.sum((D[1:] + D[:-1]) / 2 * np.diff(Epsilon))
+    N2 = np.sum((N[:, 1:] + N[:, :-1]) / 2 * np.diff(Epsilon), axis=-1)
+    D2 = np.sum((D[:, 1:] + D[:, :-1]) / 2 * np.diff(Epsilon), axis=-1)
 
     #return the final result
     Q0 = N2 / D2
@@ -61,27 +80,49 @@ def RMSE(original_Rtable, adjusted_Rtable):
     This function calculates the RMSE between the original table and the adjusted one
     """
     # we first check that the two tables have the same dimensions
-    if original_Rtable.shape != adjusted_Rtable.shape:
-        print('The two tables must have the same dimensions')
-        exit()
+    if np.shape(original_Rtable) != np.shape(adjusted_Rtable):
+        raise ValueError('The two tables must have the same dimensions')
+
+    return RMSEBatch(np.asarray(original_Rtable)[np.newaxis], np.asarray(adjusted_Rtable)[np.newaxis])[0]
+
+def RMSEBatch(original_Rtables, adjusted_Rtables):
+    """
+    The RMSE between each original table of the stack and its adjusted one
+    """
+    # we first check that the two stacks have the same dimensions
+    if np.shape(original_Rtables) != np.shape(adjusted_Rtables):
+        raise ValueError('The two stacks of tables must have the same dimensions')
 
     # we calculate the RMSE
-    RMSE = np.sum((original_Rtable - adjusted_Rtable)**2, axis = 0)
-    RMSE = np.sum(RMSE, axis = 0)
-    RMSE = np.sqrt(RMSE/(original_Rtable.shape[0]*original_Rtable.shape[1]))
+    RMSE = np.sum((original_Rtables - adjusted_Rtables)**2, axis = -2)
+    RMSE = np.sum(RMSE, axis = -1)
+    RMSE = np.sqrt(RMSE/(original_Rtables.shape[-2]*original_Rtables.shape[-1]))
 
     return RMSE
 
 def deltaQ0S1(original_Rtable, adjusted_Rtable):
-    Q = (Q0_Trapezes(original_Rtable) - Q0_Trapezes(adjusted_Rtable)) ** 2
-    S = (S1(original_Rtable) - S1(adjusted_Rtable)) ** 2
+    return deltaQ0S1Batch(np.asarray(original_Rtable)[np.newaxis], np.asarray(adjusted_Rtable)[np.newaxis])[0]
+
+def deltaQ0S1Batch(original_Rtables, adjusted_Rtables, originalQ0=None, originalS1=None):
+    #the Q0_Trapezes and S1 of the original tables can be given if they are already known
+    if originalQ0 is None:
+        originalQ0 = Q0_TrapezesBatch(original_Rtables)
+    if originalS1 is None:
+        originalS1 = S1Batch(original_Rtables)
+    Q = (originalQ0 - Q0_TrapezesBatch(adjusted_Rtables)) ** 2
+    S = (originalS1 - S1Batch(adjusted_Rtables)) ** 2
     return np.sqrt((np.pi ** 2 * Q + S) / 2)
 
 def deltaR(original_Rtable, adjusted_Rtable):
-    err = RMSE(original_Rtable, adjusted_Rtable)
-    meanO = mean(original_Rtable)
-    meanA = mean(adjusted_Rtable)
-    return 2 * err / (meanO + meanA)
+    return deltaRBatch(np.asarray(original_Rtable)[np.newaxis], np.asarray(adjusted_Rtable)[np.newaxis])[0]
+
+def deltaRBatch(original_Rtables, adjusted_Rtables, originalMeans=None):
+    #the means of the original tables can be given if they are already known (they are the same for every fitness evaluation)
+    err = RMSEBatch(original_Rtables, adjusted_Rtables)
+    if originalMeans is None:
+        originalMeans = meanBatch(original_Rtables)
+    meanA = meanBatch(adjusted_Rtables)
+    return 2 * err / (originalMeans + meanA)
 
 def Entropy(r_table):
     """
@@ -90,19 +131,33 @@ def Entropy(r_table):
     uniformity of the R-table the smaller the entropy, the more
     compressable the R-table is.
     """
+    return EntropyBatch(np.asarray(r_table)[np.newaxis])[0]
 
-    #carefull r-tables have 0 in them, so we need to add a small value to avoid log(0)
-    #convert r-table to float 
-    r_table = r_table.astype(float)
-    r_table += 1e-10
-
-    #flatten the r-table
-    r_table = r_table.flatten()
+def EntropyBatch(r_tables):
+    """
+    The entropy of each R-table of the stack
+    """
 
-    #calculate the probability of each element by dividing the count of each individual value by the total number of elements
-    values, counts = np.unique(r_table, return_counts=True)
-    probabilities = counts / len(r_table)
-    entropy = -np.sum(probabilities * np.log2(probabilities))
+    #carefull r-tables have 0 in them, so we need to add a small value to avoid log(0)
+    #convert r-tables to float and flatten them
+    r_tables = np.reshape(r_tables, (len(r_tables), -1)).astype(float)
+    r_tables += 1e-10
+
+    #the probability of each value is the number of times it appears divided by the total number of elements,
+    #the values of each table are sorted so that equal values are next to each other
+    r_tables = np.sort(r_tables, axis=-1)
+    nValues = r_tables.shape[-1]
+    newValue = np.ones(r_tables.shape, dtype=bool)
+    newValue[:, 1:] = r_tables[:, 1:] != r_tables[:, :-1]
+
+    #the number of times the value of each element appears in its table
+    starts = np.flatnonzero(newValue.flatten())
+    counts = np.diff(np.append(starts, newValue.size))
+    counts = np.repeat(counts, counts).reshape(r_tables.shape)
+
+    #each element carries 1/count of the probability * log2(probability) of its value
+    probabilities = counts / nValues
+    entropy = -np.sum(probabilities * np.log2(probabilities) / counts, axis=-1)
 
     return entropy
 
@@ -110,13 +165,37 @@ def Smoothness(r_table):
     """
     This function calculates a smoothness of the R-table
     """
+    return SmoothnessBatch(np.asarray(r_table)[np.newaxis])[0]
+
+def SmoothnessBatch(r_tables):
+    """
+    The smoothness of each R-table of the stack
+    """
 
     # we calculate the smoothness
-    smoothness = np.sum(np.abs(r_table[1:,:] - r_table[:-1,:]), axis = 0)
-    smoothness = np.sum(smoothness, axis = 0)
+    smoothness = np.sum(np.abs(r_tables[:, 1:,:] - r_tables[:, :-1,:]), axis = -2)
+    smoothness = np.sum(smoothness, axis = -1)
 
     # normalize the smoothness
-    smoothness /= np.sum(np.sum(r_table, axis = 0), axis = 0)
-    smoothness /= r_table.shape[0] - 1
+    smoothness = smoothness / np.sum(np.sum(r_tables, axis = -2), axis = -1)
+    smoothness /= r_tables.shape[-2] - 1
+
+    return smoothness
+
+class OriginalMetrics:
+    """
+    The coefficients of the original r-tables of a database, computed once.
+    They are the same every time the tables are compared to adjusted ones (every fitness evaluation of the genetic algorithms).
+    """
+
+    def __init__(self, r_tables):
+        r_tables = np.asarray(r_tables)
+        self.means = meanBatch(r_tables)
+        self.S1 = S1Batch(r_tables)
+        self.Q0_Trapezes = Q0_TrapezesBatch(r_tables)
+
+    def deltaR(self, r_tables, adjusted_Rtables):
+        return deltaRBatch(r_tables, adjusted_Rtables, self.means)
 
-    return smoothness
\ No newline at end of file
+    def deltaQ0S1(self, r_tables, adjusted_Rtables):
+        return deltaQ0S1Batch(r_tables, adjusted_Rtables, self.Q0_Trapezes, self.S1)
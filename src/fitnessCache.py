@@ -0,0 +1,56 @@
+import numpy as np
+import hashlib
+import sqlite3
+
+# A fitness cache on disk, shared by every genetic algorithm run (and every worker process of a run)
+# A fitness is stored for a set of r-tables, a partition, the free constant option and the smoothing mode,
+# so any run over the same data can reuse what the previous ones already computed
+
+def tablesHash(r_tables, weights=None):
+    #content hash of the whole stack of r-tables, the shape is part of the hash so (N, 29, 20) stacks never collide
+    #the weights of the tables (see loadData.uniqueRtables), if any, change the fitness values so they are part of it too
+    r_tables = np.ascontiguousarray(r_tables, dtype=float)
+    h = hashlib.sha256()
+    h.update(str(r_tables.shape).encode())
+    h.update(r_tables.tobytes())
+    if weights is not None:
+        h.update(b'weights')
+        h.update(np.ascontiguousarray(weights, dtype=float).tobytes())
+    return h.hexdigest()
+
+class FitnessCache:
+
+    def __init__(self, path, tablesHash, freeConstant=False, smoothing='rp'):
+        self.path = path
+        self.tablesHash = tablesHash
+        self.freeConstant = int(bool(freeConstant))
+        self.smoothing = smoothing
+
+        #several processes write at the same time, the write ahead log lets the readers go on while one of them writes
+        #and the timeout makes the writers wait for each other instead of failing
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fitness (tables TEXT, partition BLOB, freeConstant INTEGER, smoothing TEXT, '
+                                'fitness REAL, PRIMARY KEY (tables, partition, freeConstant, smoothing))')
+        self.connection.commit()
+
+    def get(self, keys):
+        #returns a dictionary with the fitness of the keys that are in the cache
+        found = {}
+        keys = list(keys)
+        #sqlite limits the number of parameters of a query
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start+500]
+            rows = self.connection.execute('SELECT partition, fitness FROM fitness WHERE tables = ? AND freeConstant = ? AND smoothing = ? '
+                                           'AND partition IN (' + ','.join('?' * len(chunk)) + ')',
+                                           [self.tablesHash, self.freeConstant, self.smoothing] + chunk).fetchall()
+            found.update((bytes(key), value) for key, value in rows)
+        return found
+
+    def put(self, key, fitness):
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO fitness VALUES (?, ?, ?, ?, ?)',
+                                    (self.tablesHash, key, self.freeConstant, self.smoothing, float(fitness)))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+import hashlib
+import time
+import sys
+import os
+
+# Loading of the r-tables from the excel files
+# Parsing an excel file is slow, so every workbook is parsed once (all its sheets at once) and the
+# validated tables are stored in a binary file in a cache folder, the next runs load them from there
+
+# What was found in each sheet of a workbook
+OK, TOO_SMALL, NAN, NOT_NUMBERS, OLD_FORMAT = 'ok', 'tooSmall', 'nan', 'notNumbers', 'oldFormat'
+
+def readWorkbook(filePath):
+    #parses all the sheets of the workbook in one go
+    #returns the sheet names, what was found in each sheet and a (nSheets, 29, 20) stack of the tables (zeros if not an r-table)
+    names, statuses, tables, integers = [], [], [], []
+
+    for sheet, r_tb in pd.read_excel(filePath, sheet_name=None, header=None).items():
+        # resize the r_tb to be 20*29
+        r_tb = r_tb.iloc[0:29, 0:20]
+        table = np.zeros((29,20))
+        integer = False
+
+        if r_tb.shape[0] < 29 or r_tb.shape[1] < 20:
+            status = TOO_SMALL
+        elif r_tb.isnull().values.any():
+            status = NAN
+        else:
+            try:
+                # the tables keep the type they have in the excel file (integers for some databases)
+                integer = np.issubdtype(r_tb.to_numpy().dtype, np.integer)
+                table = r_tb.to_numpy(dtype=float)
+                # no r-table should have B1==0, this means that the r-table starts at B2 (old format)
+                status = OLD_FORMAT if table[0, 1] == 0 else OK
+            except (ValueError, TypeError):
+                status = NOT_NUMBERS
+
+        names.append(str(sheet))
+        statuses.append(status)
+        tables.append(table)
+        integers.append(integer)
+
+    return names, statuses, np.array(tables).reshape(-1, 29, 20), np.array(integers, dtype=bool)
+
+def cacheFile(filePath, cacheFolder):
+    #the cache file of a workbook is only valid for this exact file, same path, same size and same modification time
+    stat = os.stat(filePath)
+    key = hashlib.sha1((os.path.abspath(filePath) + '|' + str(stat.st_size) + '|' + str(stat.st_mtime_ns)).encode()).hexdigest()
+    return os.path.join(cacheFolder, os.path.splitext(os.path.basename(filePath))[0] + '_' + key[:16] + '.npz')
+
+def loadWorkbook(filePath, cacheFolder=None):
+    #same as readWorkbook, but through the cache if a cache folder is given
+    if cacheFolder is None:
+        return readWorkbook(filePath)
+
+    cachePath = cacheFile(filePath, cacheFolder)
+    if os.path.isfile(cachePath):
+        with np.load(cachePath, allow_pickle=False) as cached:
+            return list(cached['names']), list(cached['statuses']), cached['tables'], cached['integers']
+
+    names, statuses, tables, integers = readWorkbook(filePath)
+
+    #write to a temporary file first, so that an interrupted run never leaves a broken cache file
+    os.makedirs(cacheFolder, exist_ok=True)
+    temporaryPath = cachePath + '.' + str(os.getpid()) + '.tmp.npz'
+    np.savez(temporaryPath, names=np.array(names, dtype=str), statuses=np.array(statuses, dtype=str), tables=tables, integers=integers)
+    os.replace(temporaryPath, cachePath)
+
+    return names, statuses, tables, integers
+
+def timedLoadWorkbook(args):
+    #loadWorkbook for a worker process, also returns how long it took
+    filePath, cacheFolder = args
+    start = time.time()
+    workbook = loadWorkbook(filePath, cacheFolder)
+    return workbook, time.time() - start
+
+def loadWorkbooks(fileList, cacheFolder=None, jobs=1):
+    #loads the workbooks one per task over jobs processes, and yields (workbook, seconds) in the order of fileList
+    tasks = [(filePath, cacheFolder) for filePath in fileList]
+    if jobs <= 1 or len(fileList) <= 1:
+        for task in tasks:
+            yield timedLoadWorkbook(task)
+        return
+
+    with mp.Pool(processes=min(jobs, len(fileList))) as pool:
+        #imap keeps the order of the files, whatever order the workers finish in
+        #the files are sent a few at a time, so that the workers never get far ahead of the caller (bounded memory)
+        window = 2 * jobs
+        for start in range(0, len(tasks), window):
+            for result in pool.imap(timedLoadWorkbook, tasks[start:start+window]):
+                yield result
+
+def selectRtables(filePath, names, statuses, tables, integers, sheets, ignore, verbose):
+    #keeps the r-tables of the workbook the user asked for, returns a list of (name, table)
+    selected = []
+    for name, status, table, integer in zip(names, statuses, tables, integers):
+
+        #Feuil1 is the default name of the first sheet in an excel file, we don't want to use it for most databases
+        if name == 'Feuil1' or name in ignore:
+            if verbose:
+                print('Sheet %s in file %s is ignored, skipping' % (name, filePath))
+            continue
+
+        #if the user specified the sheets to use, we only want to use those
+        if sheets != ["None"] and name not in sheets:
+            if verbose:
+                print('Sheet %s in file %s is not in the list of sheets to use, skipping' % (name, filePath))
+                print('looking for sheets: ' + str(sheets))
+            continue
+
+        # if the dataframe is smaller than 20*29, skip it
+        if status == TOO_SMALL:
+            continue
+
+        # if there are any Nan values, return an error and skip it
+        if status == NAN:
+            print('Error: File %s contains NaN values in sheet %s, this is not an r-table, call it \
+                    \'Feuil1\' for it to be skipped or correct the error' % (filePath, name))
+            continue
+
+        if status == NOT_NUMBERS:
+            print('Error: File %s contains values that are not numbers in sheet %s, this is not an r-table, call it \
+                    \'Feuil1\' for it to be skipped or correct the error' % (filePath, name))
+            continue
+
+        if status == OLD_FORMAT:
+            print("This format is no longer supported, please use the new format, bare r-tables that should start at A1 adn end at T29 in excel file.")
+            sys.exit(1)
+
+        if integer:
+            table = table.astype(np.int64)
+        selected.append((name, table))
+
+    return selected
+
+def iterRtables(fileList, sheets, ignore, cacheFolder=None, jobs=1, verbose=False):
+    #yields the r-tables the user asked for one at a time, as (name, source file, table), in the order of the files and sheets
+    #only one workbook (per job) is in memory at a time
+    for filePath, ((names, statuses, tables, integers), seconds) in zip(fileList, loadWorkbooks(fileList, cacheFolder, jobs)):
+        if verbose:
+            print("Loaded %s in %s seconds" % (filePath, round(seconds, 2)))
+
+        for name, r_tb in selectRtables(filePath, names, statuses, tables, integers, sheets, ignore, verbose):
+            yield name, filePath, r_tb
+
+def uniqueRtables(r_tables):
+    #the same measurements are often found in several workbooks, the tables with exactly the same values are only kept once
+    #returns the index of the first copy of every distinct table, the index of the distinct table of every table
+    #and the number of copies of every distinct table (its weight)
+    firsts, inverse, seen = [], [], {}
+    for i, r_tb in enumerate(r_tables):
+        #+ 0.0 turns -0 into 0, and the integer tables hash like the same float tables
+        key = hashlib.sha1((np.ascontiguousarray(r_tb, dtype=float) + 0.0).tobytes()).digest()
+        if key not in seen:
+            seen[key] = len(firsts)
+            firsts.append(i)
+        inverse.append(seen[key])
+    return np.array(firsts, dtype=int), np.array(inverse, dtype=int), np.bincount(inverse, minlength=len(firsts))
+
+def stackRtables(r_tables, compact=False):
+    #a (N, 29, 20) stack of a list of tables, in the type of the tables
+    #or, if compact, a contiguous single precision stack: half the memory and half the data sent to the worker processes,
+    #the r values are measured with far fewer than 7 significant digits, and the integer tables are exact in single precision
+    if compact:
+        return np.ascontiguousarray(np.asarray(r_tables, dtype=np.float32).reshape(-1, 29, 20))
+    return np.array(r_tables)
+
+def iterRtableChunks(rtables, chunkSize=0, compact=False):
+    #groups the (name, source file, table) of iterRtables in chunks of chunkSize tables (or all of them if chunkSize is 0)
+    #yields (names, source files, (n, 29, 20) stack of tables), see stackRtables for compact
+    names, files, tables = [], [], []
+    for name, filePath, r_tb in rtables:
+        names.append(name)
+        files.append(filePath)
+        tables.append(r_tb)
+        if len(tables) == chunkSize:
+            yield names, files, stackRtables(tables, compact)
+            names, files, tables = [], [], []
+
+    if len(tables) > 0:
+        yield names, files, stackRtables(tables, compact)
@@ -8,15 +8,14 @@ tanEpsilon = np.array([0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2, 2.5, 3, 3.5, 4
 epsilon = np.arctan(tanEpsilon)
 
 def loadPartition(filename, sheetname):
-    #load the partition from the excel file
-    partition = np.zeros((29,20))
+    #load the partition from the excel file, as a grid of region numbers (one byte each)
     with pd.ExcelFile(filename) as path:
         partition = pd.read_excel(path, sheet_name=sheetname, header=None).to_numpy()
-    return partition
+    return partition.astype(np.uint8)
 
 def stopsToPartition(stops):
-    #convert the stops to a partition of integers
-    partition = np.zeros((29,20))
+    #convert the stops to a partition of integers (one byte per cell, there are never more than 255 regions)
+    partition = np.zeros((29,20), dtype=np.uint8)
     c=0
     for i in range(20):
         #if we overpass a stop, we increment c
@@ -40,74 +39,78 @@ def partitionToStops(partition):
     stops[0] = 0
     return stops
 
-def randomStops(n=3, print = False):
-    #generate n-1 distinct values of the beta vector to be used as stops
-    stops = np.zeros(n)
-    for i in range(n):
-        stops[i] = np.random.randint(0,180)
-        while np.any(stops[i] == stops[:i]):
-            stops[i] = np.random.randint(0,180)
-    stops = np.sort(stops)
-    stops[0] = 0
-    stops = np.append(stops, 180)
-    return stopsToPartition(stops)
-
-#Four way flood fill algorithm + rolling average
-def randomPartition(n=3, show=False):
-    partition = np.zeros((29,20))
-    databis = np.zeros((29,20))
-    startpoints = np.zeros((n,2))
-
-    #choose n random distinct starting points
-    for i in range(n):
-        startpoints[i,0] = np.random.randint(0,29)
-        startpoints[i,1] = np.random.randint(0,20)
-        while np.any(startpoints[i,:] == startpoints[:i,:]):
-            startpoints[i,0] = np.random.randint(0,29)
-            startpoints[i,1] = np.random.randint(0,20)
-
-    #assign the starting points to the partition
-    for i in range(n):
-        partition[int(startpoints[i,0]), int(startpoints[i,1])] = i+1
- 
-    while np.any(partition==0):
-
-        #choose a random permutation of the table to ensure the algorithm is not biased
-        perm = np.random.permutation(580)
-
-        for k, l in np.ndindex(partition.shape):
-            
-            i, j = perm[(k*20+l)%580]//20, perm[(k*20+l)%580]%20
-
-            if partition[i,j] != 0:
-                #spread the value to the surrounding cells
-                if i != 0:
-                    if partition[i-1,j] == 0:
-                        databis[i-1,j] = partition[i,j]
-                if i != 28:
-                    if partition[i+1,j] == 0:
-                        databis[i+1,j] = partition[i,j]
-                if j != 0:
-                    if partition[i,j-1] == 0:
-                        databis[i,j-1] = partition[i,j]
-                if j != 19:
-                    if partition[i,j+1] == 0:
-                        databis[i,j+1] = partition[i,j]
-        partition = databis.copy()
-
-    #now we do a discrete rolling 3x3 average to smooth the partition
-    count = np.zeros((27, 18, n), dtype=int)
-
-    for k in range(-1, 2):
-        for l in range(-1, 2):
-            for i in range(n):
-                count[:,:,i] += (partition[(1 + k):(28 + k), (1 + l):(19 + l)] == i+1) * 1
-
-    partition[1:28, 1:19] = np.argmax(count, axis=2) + 1
+def randomStops(n=3, print = False, rng=None):
+    #a single random beta partition is just a population of one
+    return randomStopsBatch(1, n, rng)[0]
+
+def randomStopsBatch(nPartitions, n=3, rng=None):
+    #generates nPartitions random beta partitions at once, (nPartitions, 29, 20), each with exactly n ellipsoids
+    #the n-1 inner stops are distinct columns of beta (between beta[1] and beta[-2], so no group is empty),
+    #a column is drawn with a probability proportional to the width of its beta interval, as a stop drawn uniformly in [0, 180] would be
+    if rng is None:
+        rng = np.random.default_rng()
+
+    #weighted sampling without replacement: the n-1 largest log(weight) + gumbel noise (gumbel top-k trick)
+    weights = np.diff(beta)[:-1]
+    keys = np.log(weights) + rng.gumbel(size=(nPartitions, len(weights)))
+    columns = np.sort(np.argsort(-keys, axis=1)[:, :n-1] + 1, axis=1)
+
+    #the group of a column is one more than the number of stops up to it, the last column is in the last group
+    partitions = np.zeros((nPartitions, 29, 20), dtype=np.uint8)
+    groups = 1 + np.sum(columns[:, :, np.newaxis] <= np.arange(20), axis=1)
+    groups[:, -1] = n
+    partitions[:] = groups[:, np.newaxis, :]
+    return partitions
+
+#Multi-source random growth + rolling majority
+def randomPartition(n=3, show=False, rng=None):
+    #a single random partition is just a population of one
+    partition = randomPartitions(1, n, rng)[0]
 
     #make an imshow plot if the user wants to see the result
     if show:
         plt.imshow(partition, cmap='Set2')
         plt.show()
-    
-    return partition
\ No newline at end of file
+
+    return partition
+
+def randomPartitions(nPartitions, n=3, rng=None, growth=0.5):
+    #generates nPartitions random partitions at once, (nPartitions, 29, 20) region numbers of one byte, each with exactly n regions
+    #n distinct seed cells grow together: at each step every empty cell next to a region joins one of its neighbouring
+    #regions (chosen at random) with probability growth, which gives irregular regions, then a 3x3 majority smooths them
+    if rng is None:
+        rng = np.random.default_rng()
+
+    #choose n random distinct seed cells in every partition
+    seeds = np.argsort(rng.random((nPartitions, 580)), axis=1)[:, :n]
+    partitions = np.zeros((nPartitions, 580), dtype=int)
+    np.put_along_axis(partitions, seeds, np.arange(1, n+1), axis=1)
+    partitions = partitions.reshape(nPartitions, 29, 20)
+
+    while np.any(partitions == 0):
+        #the regions of the four neighbours of every cell (0 outside of the table)
+        padded = np.pad(partitions, ((0, 0), (1, 1), (1, 1)))
+        neighbours = np.stack((padded[:, :-2, 1:-1], padded[:, 2:, 1:-1], padded[:, 1:-1, :-2], padded[:, 1:-1, 2:]))
+
+        #a random neighbour that belongs to a region
+        priority = np.where(neighbours > 0, rng.random(neighbours.shape), -1)
+        chosen = np.take_along_axis(neighbours, np.argmax(priority, axis=0)[np.newaxis], axis=0)[0]
+
+        grow = (partitions == 0) & (chosen > 0) & (rng.random(partitions.shape) < growth)
+        partitions[grow] = chosen[grow]
+
+    #now we do a discrete rolling 3x3 majority to smooth the partitions
+    count = np.zeros((nPartitions, 27, 18, n), dtype=int)
+    regions = partitions[..., np.newaxis] == np.arange(1, n+1)
+
+    for k in range(-1, 2):
+        for l in range(-1, 2):
+            count += regions[:, (1 + k):(28 + k), (1 + l):(19 + l)]
+
+    partitions[:, 1:28, 1:19] = np.argmax(count, axis=-1) + 1
+
+    #the seeds keep their region, so no region can be smoothed away
+    partitions = partitions.reshape(nPartitions, 580)
+    np.put_along_axis(partitions, seeds, np.arange(1, n+1), axis=1)
+
+    return partitions.reshape(nPartitions, 29, 20).astype(np.uint8)
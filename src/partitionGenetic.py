@@ -1,71 +1,147 @@
 import numpy as np
 import multiprocessing as mp
-
-
-from partition import randomPartition
-from ellipsoidFitting import ellipsoidFitting
-from rebuildRtable import rebuildRtable
-from extractData import deltaR
-
-def fitPartitionGenetic(r_tables, beta, epsilon, nMaxGen, nIndiv, nEll, verbose):
-
-    # Initialize population of nIndiv partitions, each with nEll ellipsoids
-    partitions = np.array([randomPartition(nEll) for i in range(nIndiv)])
-    # This is to make sure that each partition has nEll ellipsoids
-
-    # TODO
-    # One annoying one in a million chance that a partition has less than nEll ellipsoids bug
-    # This is a temporary fix, we should find the bug and fix it but it's not a priority
-    # It's not a big deal because the algorithm will still work and this loop runs only once
-
-    for i in range(nIndiv):
-        while nEll != len(np.unique(partitions[i])):
-            partitions[i] = randomPartition(nEll)
-
-    # Initialize fitnessLogs map to store fitness values (key: partition, value: fitness)
-    fitnessLogs = {}
-
-    counter, reign = 0, 0
-    while reign < nMaxGen and counter < 10000:
-        counter += 1
-        print("Generation " + str(counter))
-
-        # Compute fitness of each partition
-        OldChampion = partitions[0]
-        partitions, fitnessLogs = Generation(partitions, fitnessLogs, r_tables, beta, epsilon, nEll, nIndiv, nMaxGen, reign)
-        Champion = partitions[0]
-
-        # Check if the best partition has changed, if not, increment the counter
-        if np.array_equal(OldChampion, Champion):
-            reign += 1
-        else :
-            reign = 1
-        if verbose:
-            print("Best partition of generation " + str(counter) + " has a deltaR over this data of " + \
-                str(round(fitnessLogs[str(partitions[0])], 3)) + ", it has won the last " + str(reign) + " generations.")
+import queue
+import os
+from multiprocessing import shared_memory
+
+from partition import randomPartitions
+from ellipsoidFitting import ellipsoidFittingBatch, cellStatistics, ellipsoidFittingFromStatistics
+from rebuildRtable import rebuildRtableBatch
+from extractData import deltaRBatch, meanBatch
+from fitnessCache import FitnessCache, tablesHash
+from profiler import Profiler
+from checkpoint import saveCheckpoint, loadCheckpoint, removeCheckpoint, islandCheckpoint
+from stopping import StoppingRules
+from backends import deltaRNumba, checkBackend
+
+def fitPartitionGenetic(r_tables, beta, epsilon, nMaxGen, nIndiv, nEll, verbose, fitnessCache=None, rng=None, profiler=None, \
+                        checkpoint=None, checkpointEvery=10, resume=None, islands=0, migrationInterval=5, nMigrants=2, \
+                        stopping=None, screening=0, screeningTables=0.1, batchSize=0, weights=None, backend='numpy'):
+
+    if rng is None:
+        rng = np.random.default_rng()
+    if profiler is None:
+        profiler = Profiler()
+    if stopping is None:
+        stopping = StoppingRules()
+
+    # Mini-batch mode: every generation scores its population over one batch of batchSize tables (see batchOrder)
+    batches = None
+    if 0 < batchSize < len(r_tables):
+        if screening > 0:
+            raise ValueError('The screening can not be combined with the mini-batches')
+        batches = tableBatches(meanBatch(r_tables), batchSize)
+
+    # Island model: islands populations of nIndiv partitions evolve side by side (see fitIslands)
+    if islands > 1:
+        rngs = rng.spawn(islands)
+        populations = [randomPartitions(nIndiv, nEll, islandRng) for islandRng in rngs]
+        with profiler.stage('islands'):
+            return fitIslands(r_tables, beta, epsilon, populations, nEll, nIndiv, nMaxGen, rngs, verbose, fitnessCache, \
+                              migrationInterval=migrationInterval, nMigrants=nMigrants, stopping=stopping, screening=screening, screeningTables=screeningTables, \
+                              batches=batches, weights=weights, backend=backend, algorithm='pga', checkpoint=checkpoint, checkpointEvery=checkpointEvery, \
+                              resume=resume)
+
+    # A resumed run goes on from its checkpoint, with the same population, counters, fitness logs and random stream
+    if resume is not None:
+        state = loadCheckpoint(resume, 'pga', r_tables, nEll, weights)
+        partitions, fitnessLogs, counter, reign, rng = state['partitions'], state['fitnessLogs'], state['counter'], state['reign'], state['rng']
+        evaluations = state['evaluations']
+        print("Resuming from " + resume + " at generation " + str(counter))
+    else:
+        # Initialize population of nIndiv partitions, each with exactly nEll ellipsoids
+        partitions = randomPartitions(nIndiv, nEll, rng)
+
+        # Initialize fitnessLogs map to store fitness values (key: partition, value: fitness)
+        fitnessLogs = {}
+        counter, reign = 0, 0
+        evaluations = 0
+
+    # The r-tables are only hashed once for all the checkpoints
+    hashOfTables = tablesHash(r_tables, weights) if checkpoint is not None else None
+
+    # The worker processes live for the whole run and receive the r-tables only once
+    with profiler.stage('fitness pool setup'):
+        pool = FitnessPool(r_tables, beta, epsilon, cachePath=fitnessCache, screeningTables=screeningTables if screening > 0 else 0, weights=weights, \
+                           backend=backend)
+
+    with pool:
+
+        stopping.begin()
+        while reign < nMaxGen and counter < 10000:
+            # The budgets are checked between two generations, a stopped run ends with its best partition so far
+            # and leaves a checkpoint behind, so that it can be resumed later
+            reason = stopping.stopReason(evaluations + pool.evaluations)
+            if reason is not None:
+                print("Stopping after generation " + str(counter) + ": " + reason)
+                if checkpoint is not None and checkpointEvery > 0:
+                    with profiler.stage('checkpoint'):
+                        saveCheckpoint(checkpoint, 'pga', r_tables, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables, \
+                                       evaluations=evaluations + pool.evaluations)
+                break
+
+            counter += 1
+            print("Generation " + str(counter))
+
+            # Compute fitness of each partition
+            OldChampion = partitions[0]
+            with profiler.stage('generation'):
+                partitions, fitnessLogs = Generation(partitions, fitnessLogs, pool, nEll, nIndiv, nMaxGen, reign, rng=rng, screening=screening, \
+                                                     batch=None if batches is None else batches[(counter-1) % len(batches)])
+            Champion = partitions[0]
+            stopping.update(fitnessLogs[partitionKey(Champion)])
+
+            # Check if the best partition has changed, if not, increment the counter
+            if np.array_equal(OldChampion, Champion):
+                reign += 1
+            else :
+                reign = 1
+            if verbose:
+                print("Best partition of generation " + str(counter) + " has a deltaR over this data of " + \
+                    str(round(fitnessLogs[partitionKey(partitions[0])], 3)) + ", it has won the last " + str(reign) + " generations.")
+
+            # Save everything the run needs to go on from here every checkpointEvery generations
+            if checkpoint is not None and checkpointEvery > 0 and counter % checkpointEvery == 0:
+                with profiler.stage('checkpoint'):
+                    saveCheckpoint(checkpoint, 'pga', r_tables, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables, \
+                                   evaluations=evaluations + pool.evaluations)
+        else:
+            # The run came to its end (it was not stopped by a budget), there is nothing left to resume
+            if checkpoint is not None:
+                removeCheckpoint(checkpoint)
 
     # Return the best partition (smaller fitness value is better)
-    return partitions[0], fitnessLogs[str(partitions[0])]
+    return partitions[0], fitnessLogs[partitionKey(partitions[0])]
 
-def Generation(partitions, fitnessLogs, r_tables, beta, epsilon, nEll, nIndiv, nMaxGen, reign):
+def Generation(partitions, fitnessLogs, pool, nEll, nIndiv, nMaxGen, reign, adjust=None, rng=None, screening=0, batch=None):
 
-    args = [(partitions[i], fitnessLogs, r_tables, beta, epsilon, nEll) for i in range(len(partitions))]
+    if rng is None:
+        rng = np.random.default_rng()
 
-    fitnesses = []
+    keys = [partitionKey(partition) for partition in partitions]
 
-    processes = mp.cpu_count()-1
-    pool = mp.Pool(processes=processes)
+    if batch is not None:
+        order = batchOrder(keys, fitnessLogs, pool, batch)
+    else:
+        # Only the partitions that were never evaluated are sent to the workers
+        newKeys = list(dict.fromkeys(key for key in keys if key not in fitnessLogs))
 
-    with pool as p:
-        fitnesses = p.starmap(fitness, args)
+        # With screening, the new partitions are first scored over a few tables (see FitnessPool.screen), only the best
+        # screening fraction of them get their exact fitness, with enough of them for the survivors to all have one
+        # The others are dropped, their proxy scores are never compared to exact ones nor kept in fitnessLogs
+        if screening > 0 and len(newKeys) > 0:
+            nScored = sum(key in fitnessLogs for key in keys)
+            nPromoted = max(int(np.ceil(screening * len(newKeys))), len(partitions)//2 - nScored)
+            proxies = pool.screen(newKeys)
+            newKeys = [newKeys[i] for i in np.argsort(proxies, kind='stable')[:nPromoted]]
 
-    # Update fitnessLogs (the processes need to put the results in the fitnessLogs map so they agree)
-    for i in range(len(partitions)):
-        fitnessLogs[str(partitions[i])] = fitnesses[i]
+        # Update fitnessLogs with the new fitness values
+        fitnessLogs.update(zip(newKeys, pool.evaluate(newKeys)))
 
-    
-    # Sort the fitnesses and remember the order to order the partitions
-    order = np.argsort(fitnesses)
+        fitnesses = [fitnessLogs.get(key, np.inf) for key in keys]
+
+        # Sort the fitnesses and remember the order to order the partitions
+        order = np.argsort(fitnesses)
     
     # Order the partitions
     partitions = partitions[order]
@@ -79,8 +155,12 @@ def Generation(partitions, fitnessLogs, r_tables, beta, epsilon, nEll, nIndiv, n
     elif reign > nMaxGen // 10:
         mutationAmount = 2
 
-    # Generate new partitions
-    newPartitions = np.array([generatePartition(partitions[i], nEll, mutationAmount) for i in range(len(partitions))])
+    # Generate new partitions, all at once, every child with its own random stream
+    newPartitions = mutatePartitions(partitions, nEll, mutationAmount, rng.spawn(len(partitions)))
+
+    # Some algorithms constrain the partitions (see betaGenetic.adjustPartitions)
+    if adjust is not None:
+        adjust(newPartitions, nEll)
 
     # Add the new partitions to the population
     partitions = np.concatenate((partitions, newPartitions))
@@ -89,88 +169,449 @@ def Generation(partitions, fitnessLogs, r_tables, beta, epsilon, nEll, nIndiv, n
 
     return partitions, fitnessLogs
 
-def generatePartition(partition1, nEll, mutationAmount=15):
-    #A partition is a 29x20 matrix of strictly positive integers
-    #each integers is a region of the table, to be adjusted by the ellipsoid fitting
-    partition2 = np.copy(partition1)
+def batchOrder(keys, fitnessLogs, pool, batch):
+    # Mini-batch generation: the whole population is scored over the tables of the batch only, these scores are not kept
+    # The leader of the batch is then scored over all the tables (and kept in fitnessLogs), the champion is the partition
+    # of the population with the best score over all the tables, it always comes first so that it survives
+    # Returns the order of the population: the champion, then the others by their score over the batch
+    distinctKeys = list(dict.fromkeys(keys))
+    batchScores = dict(zip(distinctKeys, pool.evaluateBatch(distinctKeys, batch)))
+    order = np.argsort([batchScores[key] for key in keys], kind='stable')
+
+    leader = keys[order[0]]
+    if leader not in fitnessLogs:
+        fitnessLogs[leader] = pool.evaluate([leader])[0]
+
+    champion = min((i for i in range(len(keys)) if keys[i] in fitnessLogs), key=lambda i: fitnessLogs[keys[i]])
+    return np.concatenate(([champion], order[order != champion]))
+
+def tableBatches(originalMeans, batchSize):
+    # The tables cut in batches of about batchSize tables, one batch per generation in turn
+    # The tables sorted by their mean are dealt to the batches one by one, so every batch goes from the darkest to the brightest table
+    nBatches = max(1, int(np.ceil(len(originalMeans) / batchSize)))
+    order = np.argsort(originalMeans, kind='stable')
+    return [np.sort(order[j::nBatches]) for j in range(nBatches)]
+
+def fitIslands(r_tables, beta, epsilon, populations, nEll, nIndiv, nMaxGen, rngs, verbose, fitnessCache=None, adjust=None, \
+               migrationInterval=5, nMigrants=2, stopping=None, screening=0, screeningTables=0.1, batches=None, weights=None, \
+               backend='numpy', algorithm='pga', checkpoint=None, checkpointEvery=10, resume=None):
+    # Island model: every population evolves in its own process, with its own random stream, without waiting for the others
+    # The islands are on a ring, every migrationInterval generations an island sends its nMigrants best partitions to the next one
+    # and takes in whatever the previous one sent (if anything), there is no barrier between the islands
+    # Every island saves its own checkpoint (see checkpoint.islandCheckpoint), a resumed run goes on from the checkpoints
+    # of all its islands, the partitions that were travelling from an island to the next one are lost
+    # Returns the best partition found by all the islands and its fitness
+    nIslands = len(populations)
+    if stopping is None:
+        stopping = StoppingRules()
+
+    # The state of each island: its population, counters, fitness logs, random stream and evaluations
+    states = [{'partitions': populations[i], 'fitnessLogs': {}, 'counter': 0, 'reign': 0, 'rng': rngs[i], 'evaluations': 0} for i in range(nIslands)]
+    if resume is not None:
+        if os.path.isfile(islandCheckpoint(resume, nIslands)):
+            raise ValueError('The checkpoints ' + resume + ' were made with more than ' + str(nIslands) + ' islands')
+        states = [loadCheckpoint(islandCheckpoint(resume, i), algorithm, r_tables, nEll, weights) for i in range(nIslands)]
+        print("Resuming " + str(nIslands) + " islands from " + resume + " at generations " + ', '.join(str(state['counter']) for state in states))
+
+    # The r-tables are only hashed once for the checkpoints of all the islands
+    hashOfTables = tablesHash(r_tables, weights) if checkpoint is not None else None
+
+    # The r-tables and their cell statistics are put once in shared memory, every island attaches to them
+    with FitnessPool(r_tables, beta, epsilon, processes=1, cachePath=fitnessCache, screeningTables=screeningTables if screening > 0 else 0, \
+                     weights=weights, backend=backend) as pool:
+        inboxes = [mp.Queue() for i in range(nIslands)]
+        results = mp.Queue()
+        islands = [mp.Process(target=runIsland, args=(i, pool.initArgs, states[i], nEll, nIndiv, nMaxGen, inboxes[i], \
+                                                      inboxes[(i+1) % nIslands], results, migrationInterval, nMigrants, adjust, verbose, \
+                                                      stopping.split(nIslands), screening, batches, algorithm, \
+                                                      None if checkpoint is None else islandCheckpoint(checkpoint, i), checkpointEvery, hashOfTables)) \
+                   for i in range(nIslands)]
+        for island in islands:
+            island.start()
+
+        champions = []
+        while len(champions) < nIslands:
+            try:
+                index, partition, value, counter, stopped = results.get(timeout=1)
+            except queue.Empty:
+                # An island that died (exit code other than 0) will never send its result
+                if any(island.exitcode not in (None, 0) for island in islands):
+                    for island in islands:
+                        island.terminate()
+                    raise RuntimeError('An island of the genetic algorithm stopped with an error')
+                continue
+            print("Island " + str(index) + " finished after " + str(counter) + " generations with a deltaR of " + str(round(value, 3)))
+            champions.append((value, index, partition, stopped))
+
+        for island in islands:
+            island.join()
+
+    # The checkpoints are kept until every island came to its end, so that a run stopped by a budget can go on
+    # with all its islands (an island that already finished then only gives its champion again)
+    if checkpoint is not None and not any(champion[3] for champion in champions):
+        for i in range(nIslands):
+            removeCheckpoint(islandCheckpoint(checkpoint, i))
+
+    # Smaller fitness value is better
+    value, index, partition, stopped = min(champions, key=lambda champion: champion[:2])
+    return partition, value
+
+def runIsland(index, initArgs, state, nEll, nIndiv, nMaxGen, inbox, outbox, results, migrationInterval, nMigrants, adjust, verbose, stopping, screening, batches, \
+              algorithm='pga', checkpoint=None, checkpointEvery=10, hashOfTables=None):
+    # The migrants sent to an island that already finished are never read, they must not keep this process alive
+    outbox.cancel_join_thread()
+
+    partitions, fitnessLogs, counter, reign, rng = state['partitions'], state['fitnessLogs'], state['counter'], state['reign'], state['rng']
+    stopped = False
+    with FitnessPool.attach(initArgs) as pool:
+
+        stopping.begin()
+        while reign < nMaxGen and counter < 10000:
+            # Every island checks its own budgets (the same clock, its share of the evaluations)
+            reason = stopping.stopReason(state['evaluations'] + pool.evaluations)
+            if reason is not None:
+                if verbose:
+                    print("Island " + str(index) + " stops after generation " + str(counter) + ": " + reason)
+                stopped = True
+                break
+            counter += 1
+
+            OldChampion = partitions[0]
+            partitions, fitnessLogs = Generation(partitions, fitnessLogs, pool, nEll, nIndiv, nMaxGen, reign, adjust=adjust, rng=rng, screening=screening, \
+                                                 batch=None if batches is None else batches[(counter-1) % len(batches)])
+            Champion = partitions[0]
+            stopping.update(fitnessLogs[partitionKey(Champion)])
+
+            if np.array_equal(OldChampion, Champion):
+                reign += 1
+            else :
+                reign = 1
+            if verbose:
+                print("Island " + str(index) + ", generation " + str(counter) + ": best deltaR of " + \
+                    str(round(fitnessLogs[partitionKey(partitions[0])], 3)) + ", it has won the last " + str(reign) + " generations.")
+
+            if migrationInterval > 0 and counter % migrationInterval == 0:
+                # The best partitions (the first ones, they are sorted) travel with their fitness, as keys
+                # with mini-batches only some of them were scored over all the tables, only those can travel
+                migrants = [partitionKey(p) for p in partitions if partitionKey(p) in fitnessLogs][:nMigrants]
+                outbox.put([(key, fitnessLogs[key]) for key in migrants])
+
+                # The immigrants take the place of the last children, never more than the children
+                immigrants = []
+                while True:
+                    try:
+                        immigrants += inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                half = len(partitions)//2
+                if half > 0:
+                    for j, (key, value) in enumerate(immigrants[-half:]):
+                        partitions[len(partitions)-1-j] = keyToPartition(key)
+                        fitnessLogs.setdefault(key, value)
+
+            if checkpoint is not None and checkpointEvery > 0 and counter % checkpointEvery == 0:
+                saveCheckpoint(checkpoint, algorithm, None, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables, \
+                               evaluations=state['evaluations'] + pool.evaluations)
+
+        # The last state of the island, whether it was stopped or came to its end, fitIslands removes the checkpoints
+        # once all the islands came to their end
+        if checkpoint is not None and checkpointEvery > 0:
+            saveCheckpoint(checkpoint, algorithm, None, nEll, partitions, fitnessLogs, counter, reign, rng, hashOfTables, \
+                           evaluations=state['evaluations'] + pool.evaluations)
+
+    results.put((index, partitions[0], fitnessLogs[partitionKey(partitions[0])], counter, stopped))
+
+def mutatePartitions(partitions, nEll, mutationAmount=15, rngs=None):
+    #mutates a whole population of partitions (P, 29, 20) at once, every child is its parent with mutationAmount expansions
+    #each child draws its regions and directions from its own random generator (rngs, one per child), so a child only depends
+    #on its parent and its own stream, whatever the rest of the population
+    if rngs is None:
+        rngs = np.random.default_rng().spawn(len(partitions))
+
+    children = np.array(partitions).astype(int)
+    nChildren = len(children)
+
+    #the random region and direction of each expansion of each child, (P, mutationAmount)
+    draws = np.array([(rng.integers(nEll, size=mutationAmount), rng.integers(4, size=mutationAmount)) for rng in rngs]).reshape(nChildren, 2, mutationAmount)
+    regions, directions = draws[:, 0] + 1, draws[:, 1]
+
+    #the labels of each child are counted in their own nEll+1 bins of a single bincount (bin 0 is not a region)
+    offsets = (np.arange(nChildren) * (nEll+1))[:, np.newaxis, np.newaxis]
 
-    #expand the regions
     for i in range(mutationAmount):
 
-        #count the number of elements in each region
-        nElsperRegion = np.zeros(nEll)
-        flatten_partition = partition2.flatten().astype(int)
-        unique_regions, region_counts = np.unique(flatten_partition, return_counts=True)
-        nElsperRegion[unique_regions - 1] = region_counts
-
-        #select a random region to expand
-        region = np.random.choice(nEll)
+        #count the number of elements in each region of each child, (P, nEll)
+        nElsperRegion = np.bincount((children + offsets).ravel(), minlength=nChildren*(nEll+1)).reshape(nChildren, nEll+1)[:, 1:]
 
         #we need to fudge the region selection if we don't want to lose regions
-        if min(region_counts) < 30:
-            region = np.argmin(region_counts)
-
-        #select a random direction to expand the region
-        direction = np.random.choice(4)
-
-        #expand the region  
-        partition2 = expand(partition2, float(region+1), direction)  
-
-    #if there are less regions than the number of ellipsoids, generate a new partition 
-    #(brings in new blood to the population)
-    if len(unique_regions) < nEll:
-        partition1 = randomPartition(nEll)
-
-    #verify that the new partition has the same number of regions
-    #if not, generate a new one
-    return partition2
-
-#expand a region in a given direction (0: left, 1: right, 2: up, 3: down)                             
-def expand(matrix, region, direction):
-    if direction == 0:
-        # Expand the region one block to the left
-        mask = (matrix[:, 1:] == region) & (matrix[:, :-1] != region)
-        matrix[:, :-1][mask] = region
-
-    elif direction == 1:
-        # Expand the region one block to the right
-        mask = (matrix[:, :-1] == region) & (matrix[:, 1:] != region)
-        matrix[:, 1:][mask] = region
-
-    elif direction == 2:
-        # Expand the region one block upwards
-        mask = (matrix[1:, :] == region) & (matrix[:-1, :] != region)
-        matrix[:-1, :][mask] = region
-
-    elif direction == 3:
-        # Expand the region one block downwards
-        mask = (matrix[:-1, :] == region) & (matrix[1:, :] != region)
-        matrix[1:, :][mask] = region
-
-    return matrix
-
-def fitness(partition, fitnessLogs, r_tables, beta, epsilon, nEll):
-    # Check if the fitness of the partition has already been calculated
-    if str(partition) in fitnessLogs:
-        return fitnessLogs[str(partition)]
-
-    # Calculate fitness of the partition
-    fitness = 0
-    for r_table in r_tables:
-        #try :
-        v = ellipsoidFitting(r_table, partition, beta, epsilon)
-        #except:
-        #    print("Error in ellipsoid fitting")
-        #    print("Partition: " + str(partition))
-        #    print("Table: " + str(r_table))
-        #    exit(1)
-        adjustedR_table = rebuildRtable(v, partition, beta, epsilon, request='rp')
-        fitness += deltaR(r_table, adjustedR_table)
-
-    fitness /= len(r_tables)
-
-    # Store the fitness of the partition
-    fitnessLogs[str(partition)] = fitness
-
-    return fitness
-
+        region = np.where(np.min(nElsperRegion, axis=1) < 30, np.argmin(nElsperRegion, axis=1) + 1, regions[:, i])
+
+        #expand the region of every child in its direction at once
+        children = expandPartitions(children, region, directions[:, i])
+
+    return children.astype(np.asarray(partitions).dtype)
+
+def expandPartitions(matrices, regions, directions):
+    #expand, for a stack of partitions (P, 29, 20) with one region and one direction per partition
+    regions = np.asarray(regions)[:, np.newaxis, np.newaxis]
+    directions = np.asarray(directions)[:, np.newaxis, np.newaxis]
+
+    # Expand the regions one block to the left
+    mask = (matrices[:, :, 1:] == regions) & (matrices[:, :, :-1] != regions) & (directions == 0)
+    matrices[:, :, :-1] = np.where(mask, regions, matrices[:, :, :-1])
+
+    # Expand the regions one block to the right
+    mask = (matrices[:, :, :-1] == regions) & (matrices[:, :, 1:] != regions) & (directions == 1)
+    matrices[:, :, 1:] = np.where(mask, regions, matrices[:, :, 1:])
+
+    # Expand the regions one block upwards
+    mask = (matrices[:, 1:, :] == regions) & (matrices[:, :-1, :] != regions) & (directions == 2)
+    matrices[:, :-1, :] = np.where(mask, regions, matrices[:, :-1, :])
+
+    # Expand the regions one block downwards
+    mask = (matrices[:, :-1, :] == regions) & (matrices[:, 1:, :] != regions) & (directions == 3)
+    matrices[:, 1:, :] = np.where(mask, regions, matrices[:, 1:, :])
+
+    return matrices
+
+def fitness(partition, r_tables, beta, epsilon, freeConstant=False, request='rp', statistics=None, originalMeans=None, weights=None):
+    # Calculate fitness of the partition, all the tables are fitted and rebuilt at once
+    # If the cell statistics of the tables are given (see cellStatistics), the fit is only a sum over the groups
+    if statistics is not None:
+        vs = ellipsoidFittingFromStatistics(*statistics, partition)
+    else:
+        vs = ellipsoidFittingBatch(r_tables, partition, beta, epsilon, freeConstant)
+    adjustedR_tables = rebuildRtableBatch(vs, partition, beta, epsilon, request=request)
+
+    return meanDeltaR(r_tables, adjustedR_tables, originalMeans, weights)
+
+def meanDeltaR(r_tables, adjustedR_tables, originalMeans=None, weights=None):
+    # The means of the original tables do not change from one evaluation to the next, they can be given once and for all
+    # A table with a weight counts as that many copies of it (see loadData.uniqueRtables)
+    if weights is not None:
+        return np.average(deltaRBatch(r_tables, adjustedR_tables, originalMeans), weights=weights)
+    return np.mean(deltaRBatch(r_tables, adjustedR_tables, originalMeans))
+
+def partitionKey(partition):
+    # A partition is stored and sent to the workers as its 580 region numbers, one byte each
+    # (the partitions already are one byte grids, see partition.randomPartitions, so there is no copy)
+    return np.ascontiguousarray(partition, dtype=np.uint8).tobytes()
+
+def keyToPartition(key):
+    return np.frombuffer(key, dtype=np.uint8).reshape(29,20)
+
+# What each worker process knows, set once by initWorker when the pool starts
+workerState = {}
+
+def initWorker(sharedArrays, beta, epsilon, freeConstant, request, cachePath, hashOfTables, backend='numpy'):
+    # The arrays are not copied, the worker looks at the shared memory blocks of the main process
+    # nothing is kept from an earlier pool of this process (the weights or a batch of other tables)
+    workerState.clear()
+    workerState['sharedMemory'] = []
+    for arrayName, (sharedName, shape, dtype) in sharedArrays.items():
+        sharedBlock = shared_memory.SharedMemory(name=sharedName)
+        workerState['sharedMemory'].append(sharedBlock)
+        workerState[arrayName] = np.ndarray(shape, dtype=dtype, buffer=sharedBlock.buf)
+    workerState['beta'] = beta
+    workerState['epsilon'] = epsilon
+    workerState['freeConstant'] = freeConstant
+    workerState['request'] = request
+    workerState['backend'] = backend
+
+    # Each worker has its own connection to the fitness cache (if any) and writes its results in it
+    workerState['cache'] = None
+    if cachePath is not None:
+        workerState['cache'] = FitnessCache(cachePath, hashOfTables, freeConstant, request)
+
+
+def compiledFitness(partition, r_tables, statistics, originalMeans, weights):
+    # The fitness with the numba backend, from scratch: the compiled kernel is fast enough not to keep any state
+    values = deltaRNumba(partition, r_tables, workerState['beta'], workerState['epsilon'], statistics, workerState['request'], originalMeans)
+    return np.average(values, weights=weights)
+
+def evaluateKey(key):
+    partition = keyToPartition(key)
+    statistics = (workerState['cellDTD'], workerState['cellDTnorms'])
+    if workerState['backend'] == 'numba':
+        value = compiledFitness(partition, workerState['r_tables'], statistics, workerState['originalMeans'], workerState.get('weights'))
+    else:
+        value = fitness(partition, workerState['r_tables'], workerState['beta'], workerState['epsilon'], request=workerState['request'], \
+                        statistics=statistics, originalMeans=workerState['originalMeans'], weights=workerState.get('weights'))
+    if workerState['cache'] is not None:
+        workerState['cache'].put(key, value)
+    return value
+
+def screenKey(key):
+    # The proxy fitness of a partition: its fitness over the screening tables only, from scratch, never cached
+    statistics = (workerState['screenDTD'], workerState['screenDTnorms'])
+    if workerState['backend'] == 'numba':
+        return compiledFitness(keyToPartition(key), workerState['screenTables'], statistics, workerState['screenMeans'], workerState.get('screenWeights'))
+    return fitness(keyToPartition(key), workerState['screenTables'], workerState['beta'], workerState['epsilon'], request=workerState['request'], \
+                   statistics=statistics, originalMeans=workerState['screenMeans'], weights=workerState.get('screenWeights'))
+
+def batchTask(task):
+    # The fitness of a partition over a batch of tables, from scratch, never cached
+    # the statistics of the batch are only sliced once per batch by each worker
+    key, batch = task
+    if workerState.get('batch') != batch.tobytes():
+        workerState['batch'] = batch.tobytes()
+        workerState['batchArrays'] = (workerState['r_tables'][batch], workerState['cellDTD'][batch], workerState['cellDTnorms'][batch], \
+                                      workerState['originalMeans'][batch], None if 'weights' not in workerState else workerState['weights'][batch])
+    tables, DTD, DTnorms, means, weights = workerState['batchArrays']
+    if workerState['backend'] == 'numba':
+        return compiledFitness(keyToPartition(key), tables, (DTD, DTnorms), means, weights)
+    return fitness(keyToPartition(key), tables, workerState['beta'], workerState['epsilon'], request=workerState['request'], statistics=(DTD, DTnorms), \
+                   originalMeans=means, weights=weights)
+
+def screeningSubset(originalMeans, screeningTables):
+    # A fixed screeningTables fraction of the tables, evenly spread from the darkest to the brightest one
+    # so that the proxy sees every kind of table of the database
+    nTables = max(1, int(round(screeningTables * len(originalMeans))))
+    order = np.argsort(originalMeans, kind='stable')
+    return np.sort(order[np.round(np.linspace(0, len(order)-1, nTables)).astype(int)])
+
+class FitnessPool:
+    # A pool of worker processes that lives for a whole genetic algorithm run,
+    # the r-tables and their cell statistics are computed and put once in shared memory, the tasks are only partition keys
+    # If a cache path is given, the fitness values are also looked up in and saved to a fitness cache on disk
+    # The numba backend (see backends.py) evaluates the partitions with a compiled kernel instead
+
+    def __init__(self, r_tables, beta, epsilon, processes=None, freeConstant=False, request='rp', cachePath=None, screeningTables=0, weights=None, \
+                 backend='numpy'):
+        checkBackend(backend)
+        # A single precision stack (see loadData.stackRtables) stays in single precision in the shared memory,
+        # the cell statistics are always in double precision, the normal equations are too ill-conditioned for anything else
+        r_tables = np.asarray(r_tables)
+        r_tables = np.ascontiguousarray(r_tables, dtype=np.float32 if r_tables.dtype == np.float32 else float)
+
+        if processes is None:
+            processes = max(1, mp.cpu_count()-1)
+        self.processes = processes
+
+        # The cell statistics do not depend on the partition, no worker needs to look at the raw design matrices again
+        cellDTD, cellDTnorms = cellStatistics(r_tables, beta, epsilon, freeConstant)
+
+        # Nor the means of the original tables, every fitness evaluation compares the same tables
+        originalMeans = meanBatch(r_tables)
+
+        arrays = [('r_tables', r_tables), ('cellDTD', cellDTD), ('cellDTnorms', cellDTnorms), ('originalMeans', originalMeans)]
+
+        # The screening tables (a fraction of the tables) and their statistics, for the proxy fitness of screen()
+        if screeningTables > 0:
+            subset = screeningSubset(originalMeans, screeningTables)
+            arrays += [('screenTables', r_tables[subset]), ('screenDTD', cellDTD[subset]), ('screenDTnorms', cellDTnorms[subset]), \
+                       ('screenMeans', originalMeans[subset])]
+
+        # The weights of the tables, if they were deduplicated (see loadData.uniqueRtables)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            arrays.append(('weights', weights))
+            if screeningTables > 0:
+                arrays.append(('screenWeights', weights[subset]))
+
+        self.sharedMemory = []
+        sharedArrays = {}
+        for arrayName, array in arrays:
+            sharedBlock = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=sharedBlock.buf)[:] = array
+            self.sharedMemory.append(sharedBlock)
+            sharedArrays[arrayName] = (sharedBlock.name, array.shape, array.dtype)
+
+        # The fitness evaluations asked for so far (the ones found in the fitness cache too), an evaluation over a batch
+        # or over the screening tables counts as the fraction of the tables it is over, for the evaluation budget of StoppingRules
+        self.evaluations = 0
+        self.nTables = len(r_tables)
+        self.nScreen = len(subset) if screeningTables > 0 else 0
+
+        self.cache = None
+        hashOfTables = None
+        if cachePath is not None:
+            hashOfTables = tablesHash(r_tables, weights)
+            self.cache = FitnessCache(cachePath, hashOfTables, freeConstant, request)
+
+        initArgs = (sharedArrays, beta, epsilon, freeConstant, request, cachePath, hashOfTables, backend)
+        self.initArgs = initArgs
+
+        # With a single process there is no point in spawning a worker, the main process does the work
+        self.pool = None
+        if processes > 1:
+            self.pool = mp.Pool(processes=processes, initializer=initWorker, initargs=initArgs)
+        else:
+            initWorker(*initArgs)
+
+    @classmethod
+    def attach(cls, initArgs):
+        # A single process pool in another process (an island), over the shared memory of an existing pool
+        # The blocks belong to the pool that created them, this one never unlinks them
+        self = cls.__new__(cls)
+        self.processes = 1
+        self.sharedMemory = []
+        self.initArgs = initArgs
+        self.pool = None
+
+        sharedArrays, beta, epsilon, freeConstant, request, cachePath, hashOfTables, backend = initArgs
+        self.evaluations = 0
+        self.nTables = sharedArrays['r_tables'][1][0]
+        self.nScreen = sharedArrays['screenTables'][1][0] if 'screenTables' in sharedArrays else 0
+        self.cache = None
+        if cachePath is not None:
+            self.cache = FitnessCache(cachePath, hashOfTables, freeConstant, request)
+
+        initWorker(*initArgs)
+        return self
+
+    def evaluate(self, keys):
+        # Returns the fitness of each partition key, in the same order
+        self.evaluations += len(keys)
+
+        found = {}
+        if self.cache is not None:
+            found = self.cache.get(keys)
+
+        # Only the keys that are not in the cache are computed
+        missing = [key for key in keys if key not in found]
+        if len(missing) > 0:
+            found.update(zip(missing, self.map(evaluateKey, missing)))
+
+        return [found[key] for key in keys]
+
+    def map(self, task, items):
+        # Runs the task over the items in this process or over the workers, in contiguous chunks, in the same order
+        if self.pool is None:
+            return [task(item) for item in items]
+        return self.pool.map(task, items, chunksize=max(1, len(items) // (4*self.processes)))
+
+    def evaluateBatch(self, keys, batch):
+        # Returns the fitness of each partition key over the tables of the batch (indices of r_tables), in the same order
+        self.evaluations += len(keys) * len(batch) / self.nTables
+        return self.map(batchTask, [(key, batch) for key in keys])
+
+    def screen(self, keys):
+        # Returns a cheap proxy of the fitness of each partition key (smaller is better), in the same order
+        # it is the fitness over the screening tables only, it can only be compared to other proxy values
+        self.evaluations += len(keys) * self.nScreen / self.nTables
+        return self.map(screenKey, list(keys))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        else:
+            if workerState['cache'] is not None:
+                workerState['cache'].close()
+            # the arrays of the state look at the shared blocks, they are dropped before the blocks are closed
+            sharedBlocks = workerState['sharedMemory']
+            workerState.clear()
+            for sharedBlock in sharedBlocks:
+                sharedBlock.close()
+        if self.cache is not None:
+            self.cache.close()
+        for sharedBlock in self.sharedMemory:
+            sharedBlock.close()
+            sharedBlock.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,100 @@
+import cProfile
+import tracemalloc
+import contextlib
+import time
+
+# Per stage timing of a run: wall time, CPU time and peak memory (tracemalloc) of every stage (loading, fitting, generations...)
+# A disabled profiler costs nothing, every stage is then an empty context
+# The stages can be nested, the peak memory of a stage includes the peaks of the stages inside it
+
+class Profiler:
+
+    def __init__(self, enabled=False, dumpCProfile=False):
+        self.enabled = enabled or dumpCProfile
+        self.records = []
+        self.stack = []
+        self.cProfile = None
+
+        if self.enabled:
+            tracemalloc.start()
+            self.start = time.perf_counter()
+            self.startCPU = time.process_time()
+        if dumpCProfile:
+            self.cProfile = cProfile.Profile()
+            self.cProfile.enable()
+
+    def stage(self, name):
+        #use as "with profiler.stage('fitting'):"
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.timedStage(name)
+
+    @contextlib.contextmanager
+    def timedStage(self, name):
+        #the peak of the enclosing stage so far is kept before the peak is reset for this one
+        if len(self.stack) > 0:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        entry = {'peak': 0}
+        self.stack.append(entry)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            self.stack.pop()
+            if len(self.stack) > 0:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            self.records.append((name, wall, cpu, peak))
+
+    def iterate(self, name, iterable):
+        #yields the items of iterable, the time spent producing each of them is recorded in the stage name
+        #(the work of a lazy iterator, such as the loading of the r-tables, is then only counted in its own stage)
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self):
+        #one line per stage: number of times it ran, total wall time, total CPU time, mean wall time and peak memory
+        stages = {}
+        for name, wall, cpu, peak in self.records:
+            count, totalWall, totalCPU, maxPeak = stages.get(name, (0, 0, 0, 0))
+            stages[name] = (count + 1, totalWall + wall, totalCPU + cpu, max(maxPeak, peak))
+
+        lines = ["%-24s %6s %12s %12s %12s %12s" % ('stage', 'runs', 'wall (s)', 'CPU (s)', 'mean (s)', 'peak (MB)')]
+        for name, (count, totalWall, totalCPU, maxPeak) in stages.items():
+            lines.append("%-24s %6d %12.3f %12.3f %12.4f %12.1f" % (name, count, totalWall, totalCPU, totalWall / count, maxPeak / 2**20))
+        lines.append("%-24s %6s %12.3f %12.3f" % ('total', '', time.perf_counter() - self.start, time.process_time() - self.startCPU))
+        return '\n'.join(lines)
+
+    def finish(self, summaryPath=None, cProfilePath=None):
+        #prints the summary and saves it (and the cProfile statistics, if any) in the given files
+        if not self.enabled:
+            return
+
+        if self.cProfile is not None:
+            self.cProfile.disable()
+            if cProfilePath is not None:
+                self.cProfile.dump_stats(cProfilePath)
+
+        summary = self.summary()
+        print(summary)
+
+        if summaryPath is not None:
+            with open(summaryPath, 'w') as f:
+                f.write(summary + '\n')
+                #then every run of every stage in order, one line per generation of the genetic algorithms for example
+                f.write('\n%-24s %6s %12s %12s %12s\n' % ('stage', 'run', 'wall (s)', 'CPU (s)', 'peak (MB)'))
+                runs = {}
+                for name, wall, cpu, peak in self.records:
+                    runs[name] = runs.get(name, 0) + 1
+                    f.write('%-24s %6d %12.4f %12.4f %12.1f\n' % (name, runs[name], wall, cpu, peak / 2**20))
+
+        tracemalloc.stop()
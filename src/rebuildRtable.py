@@ -5,88 +5,102 @@ def rebuildRtable(v, partition, beta, epsilon, rollAverages = True, request = 'n
     #ef = ellipsoid fitting
     #bga = beta genetic algorithm (colmuns)
     #pga = partitioning genetic algorithm (rolling window over edges)
-    
+
+    #a single set of coefficients is just a stack of one
+    return rebuildRtableBatch(np.asarray(v)[np.newaxis], partition, beta, epsilon, rollAverages, request, verbose)[0]
+
+def rebuildRtableBatch(v, partition, beta, epsilon, rollAverages = True, request = 'none', verbose = False):
+    #rebuilds a whole stack of r-tables from coefficients of shape (N, nEll, k), all sharing the same partition
+    #returns an array of shape (N, 29, 20), every cell of every table is computed at once
+    v = np.asarray(v, dtype=float)
     betaRad = beta*np.pi/180
-    data = np.zeros((29,20))
-    a = v[:,0] + v[:,1] -1
-    b = v[:,0] - 2*v[:,1] -1
-    c = v[:,1] - 2*v[:,0] -1
-    g = v[:,2]
-    p = v[:,3]
-    s = v[:,4]
-
-    #this clever trick allows us not to have to check if the values exist
-    try:
-        q = v[:,5]
-        d = v[:,6]
-    except IndexError:
-        if verbose:
-            print("No q and d values found. Setting them to 0.")
-        q = np.zeros(len(v))
-        d = np.zeros(len(v))
+
+    if v.shape[-1] <= 6 and verbose:
+        print("No q and d values found. Setting them to 0.")
 
     if verbose:
         print("Rebuilding r-table...")
 
-    for i ,j in np.ndindex(data.shape):
-        group = int(partition[i,j])-1
-        
-        A = a[group]*(np.sin(epsilon[i])**2)*(np.cos(betaRad[j])**2) + b[group]*(np.sin(epsilon[i])**2)*(np.sin(betaRad[j])**2) + c[group]*(np.cos(epsilon[i])**2) + g[group]*np.sin(epsilon[i])*np.cos(epsilon[i])*np.cos(betaRad[j])
-
-        #d != 0 makes us do much more math, so we don't do that if it's not needed
-        if d[group] == 0:
-            r_value_denom = A
-
-            #convention
-            if r_value_denom == 0:
-                data[i,j] = 0
-                continue
-
-            r_value_numer = 2*p[group]*np.sin(epsilon[i])*np.cos(betaRad[j]) + 2*s[group]*np.cos(epsilon[i])
-            
-            data[i,j] = -r_value_numer/r_value_denom
-            #print("epsilon: ", epsilon[i], "beta: ", betaRad[j], "a: ", a[group], "b: ", b[group], "c: ", c[group], "g: ", g[group], "p: ", p[group], "s: ", s[group], "q: ", q[group], "d: ", d[group], "r_value: ", data[i,j])
-            continue
-
-        B = p[group]*np.sin(epsilon[i])*np.cos(betaRad[j]) \
-        + s[group]*np.cos(betaRad[j]) \
-        + q[group]*np.sin(epsilon[i])*np.sin(betaRad[j]) 
-        
-        Disc = B**2 - 4*A*d[group]
-        if Disc < 0:
-            data[i,j] = 0
-            continue
-        data[i,j] = (-B + np.sqrt(Disc))/(2*A)
-
-    for i,j in np.ndindex(data.shape):
-        if data[i,j] < 0:
-            data[i,j] = 0
+    #the group of each cell
+    groups = np.asarray(partition).astype(int) - 1
+
+    data = rebuildCells(v, groups, epsilon[:, np.newaxis], betaRad[np.newaxis, :])
+
+    return finishRtableBatch(data, partition, rollAverages, request, verbose)
+
+def rebuildCells(v, groups, epsilon, betaRad):
+    #the r-values of some cells of every table, before the top row and the roll averages are applied
+    #groups holds the group of each cell, epsilon and betaRad the angles of each cell (anything that broadcasts to groups)
+    #returns an array of shape (N,) + groups.shape, the whole grid or any list of cells is done the same way
+
+    #the coefficients of the group of each cell
+    a = (v[...,0] + v[...,1] -1)[:, groups]
+    b = (v[...,0] - 2*v[...,1] -1)[:, groups]
+    c = (v[...,1] - 2*v[...,0] -1)[:, groups]
+    g = v[:, groups, 2]
+    p = v[:, groups, 3]
+    s = v[:, groups, 4]
+
+    #there are only q and d values if there are at least 7 coefficients
+    if v.shape[-1] > 6:
+        q = v[:, groups, 5]
+        d = v[:, groups, 6]
+    else:
+        q = np.zeros(a.shape)
+        d = np.zeros(a.shape)
+
+    #the angles of the cells, computed once
+    sinEpsilon = np.sin(epsilon)
+    cosEpsilon = np.cos(epsilon)
+    sinBeta = np.sin(betaRad)
+    cosBeta = np.cos(betaRad)
+
+    A = a*(sinEpsilon**2)*(cosBeta**2) + b*(sinEpsilon**2)*(sinBeta**2) + c*(cosEpsilon**2) + g*sinEpsilon*cosEpsilon*cosBeta
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #d == 0, the linear case, A == 0 is set to 0 by convention
+        r_value_numer = 2*p*sinEpsilon*cosBeta + 2*s*cosEpsilon
+        linear = np.where(A == 0, 0, -r_value_numer/np.where(A == 0, 1, A))
+
+        #d != 0, the quadratic case, negative discriminants are set to 0
+        B = p*sinEpsilon*cosBeta + s*cosBeta + q*sinEpsilon*sinBeta
+        Disc = B**2 - 4*A*d
+        quadratic = np.where(Disc < 0, 0, (-B + np.sqrt(np.maximum(Disc, 0)))/(2*A))
+
+    data = np.where(d == 0, linear, quadratic)
+    data[data < 0] = 0
+    return data
+
+def finishRtableBatch(data, partition, rollAverages = True, request = 'none', verbose = False):
+    #applies the top row average and the roll averages to a stack of rebuilt cells of shape (N, 29, 20)
+    data = np.copy(data)
 
     #the top row is set to it's average value (all joins at the top of the solid)
-    data [0,:] = np.mean(data[0,:])
-    
+    data[:, 0, :] = np.mean(np.ascontiguousarray(data[:, 0, :]), axis=-1)[:, np.newaxis]
+
     newData = np.copy(data)
     #roll averages
     if rollAverages and request == 'cols':
-        #look at the first line of the partition, if any two values are different, add 2 to a counter
-        #if the counter is 2, then we have a partition
-        cols = []
-        for i in range(1, data.shape[1]-1):
-            if (partition[0,i] != partition[0,i-1]) or (partition[0,i] != partition[0,i+1]):
-                cols.append(i)
+        #a column is averaged if its partition value differs from one of its neighbours on the first line
+        firstLine = np.asarray(partition)[0]
+        cols = [i for i in range(1, data.shape[2]-1) if (firstLine[i] != firstLine[i-1]) or (firstLine[i] != firstLine[i+1])]
         if verbose:
             print('rolling averages over columns: ', cols)
-        for i in cols:
-            newData[:,i] = (data[:,i-1] + data[:,i] + data[:,i+1])/3
+        cols = np.array(cols, dtype=int)
+        newData[:, :, cols] = (data[:, :, cols-1] + data[:, :, cols] + data[:, :, cols+1])/3
 
     if rollAverages and request == 'rp':#random partition
         if verbose:
             print('rolling averages over random partition')
-        for j in range(1,19):
-            for i in range(1,28):
-                if partition[i,j] != partition[i-1,j]:
-                    newData[i,j] = (data[i,j-1] + data[i,j] + data[i,j+1])/3
-                if partition[i,j] != partition[i+1,j]:
-                    newData[i,j] = (data[i-1,j] + data[i,j] + data[i+1,j])/3
-                    
-    return newData
\ No newline at end of file
+        partition = np.asarray(partition)
+        inner = partition[1:28, 1:19]
+        #edges with the cell above are averaged horizontally, edges with the cell below vertically (this one wins)
+        horizontal = inner != partition[0:27, 1:19]
+        vertical = inner != partition[2:29, 1:19]
+        horizontalAverages = (data[:, 1:28, 0:18] + data[:, 1:28, 1:19] + data[:, 1:28, 2:20])/3
+        verticalAverages = (data[:, 0:27, 1:19] + data[:, 1:28, 1:19] + data[:, 2:29, 1:19])/3
+        inside = newData[:, 1:28, 1:19]
+        inside[:, horizontal] = horizontalAverages[:, horizontal]
+        inside[:, vertical] = verticalAverages[:, vertical]
+
+    return newData
@@ -0,0 +1,64 @@
+import numpy as np
+
+# Representative r-tables: many tables of a database are close to each other (the road surfaces fall into a few families),
+# so a partition can be searched over a few representative tables, each with the weight of the tables it stands for,
+# and then checked over all the tables
+# The tables are clustered by their shape (each table divided by its mean) with k-medoids, the representatives are the medoids
+
+def shapeFeatures(r_tables):
+    #(N, 580) the cells of every table divided by the mean of the table, so only the shape of the table counts
+    r_tables = np.asarray(r_tables, dtype=float).reshape(len(r_tables), -1)
+    means = np.mean(r_tables, axis=1, keepdims=True)
+    return r_tables / np.where(means == 0, 1, means)
+
+def distances(a, b):
+    #(len(a), len(b)) euclidean distances between the rows of a and the rows of b
+    squared = np.sum(a**2, axis=1)[:, np.newaxis] + np.sum(b**2, axis=1)[np.newaxis, :] - 2 * np.matmul(a, b.T)
+    return np.sqrt(np.maximum(squared, 0))
+
+def kMedoids(features, nClusters, weights=None, rng=None, maxIter=100):
+    #weighted k-medoids (alternating assignment and medoid update) with a k-means++ start
+    #returns the indices of the medoids and the cluster of every row
+    if rng is None:
+        rng = np.random.default_rng(0)
+    if weights is None:
+        weights = np.ones(len(features))
+    weights = np.asarray(weights, dtype=float)
+
+    #k-means++: every new medoid is drawn with a probability that grows with the distance to the closest medoid so far
+    medoids = [rng.choice(len(features), p=weights / np.sum(weights))]
+    closest = distances(features, features[medoids])[:, 0]
+    for k in range(1, nClusters):
+        p = weights * closest**2
+        if np.sum(p) == 0:
+            break
+        medoids.append(rng.choice(len(features), p=p / np.sum(p)))
+        closest = np.minimum(closest, distances(features, features[medoids[-1:]])[:, 0])
+    medoids = np.array(medoids)
+
+    for iteration in range(maxIter):
+        labels = np.argmin(distances(features, features[medoids]), axis=1)
+
+        #the new medoid of a cluster is the member with the smallest weighted sum of distances to the other members
+        newMedoids = np.copy(medoids)
+        for k in range(len(medoids)):
+            members = np.flatnonzero(labels == k)
+            if len(members) > 0:
+                newMedoids[k] = members[np.argmin(np.matmul(distances(features[members], features[members]), weights[members]))]
+
+        if np.array_equal(newMedoids, medoids):
+            break
+        medoids = newMedoids
+
+    return medoids, np.argmin(distances(features, features[medoids]), axis=1)
+
+def representativeTables(r_tables, nClusters, weights=None, rng=None):
+    #the representative tables of a stack of tables (the medoids of nClusters clusters), in the order of the stack
+    #returns their indices, their weights (the total weight of the tables of their cluster) and the representative of every table
+    if weights is None:
+        weights = np.ones(len(r_tables))
+    medoids, labels = kMedoids(shapeFeatures(r_tables), min(nClusters, len(r_tables)), weights, rng)
+
+    order = np.argsort(medoids)
+    clusterWeights = np.bincount(labels, weights=weights, minlength=len(medoids))
+    return medoids[order], clusterWeights[order], np.argsort(order)[labels]
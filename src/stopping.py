@@ -0,0 +1,59 @@
+import time
+
+# Budgets of the genetic algorithms, on top of their own stopping rule (a champion that has won nMaxGen generations)
+# A run can be given a wall time budget, a budget of fitness evaluations and a convergence test: the run stops when the
+# best deltaR has improved by less than a tolerance over the last convergenceWindow generations
+# The rules are checked between two generations, a stopped run ends like a normal one, with its best partition so far
+
+class StoppingRules:
+
+    def __init__(self, timeBudget=0, evalBudget=0, convergenceWindow=0, convergenceTolerance=1e-4):
+        #0 for any of the budgets or for the window means no such rule
+        #the wall time is counted from the creation of the rules, so they are created at the start of the run
+        self.timeBudget = timeBudget
+        self.evalBudget = evalBudget
+        self.convergenceWindow = convergenceWindow
+        self.convergenceTolerance = convergenceTolerance
+        self.start = time.monotonic()
+        self.lastUpdate = self.start
+        self.lastGeneration = 0
+        self.history = []
+
+    def split(self, n):
+        #the rules of each of n islands: the same clock, and an equal share of the evaluations
+        rules = StoppingRules(self.timeBudget, self.evalBudget / n if self.evalBudget > 0 else 0, self.convergenceWindow, self.convergenceTolerance)
+        rules.start = self.start
+        return rules
+
+    def begin(self):
+        #to call right before the first generation, so that the time spent before is not taken as a generation
+        self.lastUpdate = time.monotonic()
+
+    def update(self, bestValue):
+        #to call after every generation with the fitness of the champion
+        now = time.monotonic()
+        self.lastGeneration = now - self.lastUpdate
+        self.lastUpdate = now
+        self.history.append(bestValue)
+
+    def stopReason(self, evaluations):
+        #None if the run can go on with another generation, the reason why it stops otherwise
+        #evaluations is the count of fitness evaluations so far, where an evaluation over a part of the tables counts as that part of one
+        #a run always does at least one generation so that its champion has a fitness
+        if len(self.history) == 0:
+            return None
+
+        #the next generation is expected to take as long as the last one, it is not started if it would end after the budget
+        elapsed = time.monotonic() - self.start
+        if self.timeBudget > 0 and elapsed + self.lastGeneration > self.timeBudget:
+            return "the time budget of " + str(self.timeBudget) + " seconds is spent (" + str(round(elapsed, 1)) + " seconds)"
+
+        if self.evalBudget > 0 and evaluations >= self.evalBudget:
+            return "the budget of " + str(round(self.evalBudget)) + " evaluations is spent (" + str(round(evaluations, 1)) + " evaluations)"
+
+        if self.convergenceWindow > 0 and len(self.history) > self.convergenceWindow:
+            improvement = self.history[-self.convergenceWindow-1] - self.history[-1]
+            if improvement < self.convergenceTolerance:
+                return "the best deltaR improved by " + str(improvement) + " over the last " + str(self.convergenceWindow) + " generations"
+
+        return None
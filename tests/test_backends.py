@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# The numba backend has to give the deltaR of the numpy backend for every table, to the last digits,
+# also for the beta partitions with a group of a single column whose normal equations are the worst conditioned ones
+pytest.importorskip("numba")
+
+from backends import deltaRNumpy, deltaRNumba
+from betaGenetic import allStops
+from ellipsoidFitting import cellStatistics
+from extractData import meanBatch
+from loadData import iterRtables, stackRtables
+from partition import beta, epsilon, randomPartitions, randomStopsBatch, stopsToPartition
+
+workbook = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'WetAll', 'WetCond001_049.xlsx')
+
+# Rounding only: a relative difference of a few 1e-15 per table
+tolerance = 1e-12
+
+@pytest.fixture(scope='module')
+def r_tables():
+    return stackRtables([table for name, filePath, table in iterRtables([workbook], ["None"], [])]).astype(float)
+
+def assertSameDeltaR(partition, r_tables, request):
+    statistics = cellStatistics(r_tables, beta, epsilon)
+    originalMeans = meanBatch(r_tables)
+    expected = deltaRNumpy(partition, r_tables, beta, epsilon, statistics, request, originalMeans)
+    found = deltaRNumba(partition, r_tables, beta, epsilon, statistics, request, originalMeans)
+    assert np.max(np.abs(found - expected) / expected) < tolerance
+
+@pytest.mark.parametrize('partition', randomPartitions(5, 5, np.random.default_rng(0)))
+def test_random_partitions(r_tables, partition):
+    assertSameDeltaR(partition, r_tables, 'rp')
+
+@pytest.mark.parametrize('partition', randomStopsBatch(5, 4, np.random.default_rng(1)))
+def test_beta_partitions(r_tables, partition):
+    assertSameDeltaR(partition, r_tables, 'cols')
+
+singleColumns = [stops for stops in allStops(beta, 3) if np.min(np.bincount(stopsToPartition(stops)[0])[1:]) == 1]
+
+@pytest.mark.parametrize('stops', [[0, 2, 165, 180], [0, 2, 5, 180]] + singleColumns[::7])
+def test_single_column_groups(r_tables, stops):
+    assertSameDeltaR(stopsToPartition(stops), r_tables, 'cols')
+
+def test_single_precision(r_tables):
+    assertSameDeltaR(randomPartitions(1, 5, np.random.default_rng(2))[0], r_tables.astype(np.float32), 'rp')